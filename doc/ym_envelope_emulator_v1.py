@@ -26,7 +26,10 @@
 # Class to emulate the YM2149 HW envelope generator
 # Based on http://www.cpcwiki.eu/index.php/Ym2149 FPGA logic
 # This is very slow. No longer used.
-class YmEnvelopeFPGA():
+class YmEnvelopeFPGA(object):
+
+    # the chip state is a fixed set of attributes, so use slots rather than a per-instance dict
+    __slots__ = ('__rb', '__rc', '__rd', '__cnt_div', '__env_gen_cnt', '__env_vol', '__env_inc', '__env_hold')
 
     ENV_MASTER_CLOCK = 2000000
     ENV_CONT = (1<<3)
@@ -34,6 +37,9 @@ class YmEnvelopeFPGA():
     ENV_ALT = (1<<1)
     ENV_HOLD = (1<<0)
 
+    # volume boundary state used by the shape control, 0=none, 1=bottom, 2=bottom+1, 3=top-1, 4=top
+    ENV_BOUNDARY = [1, 2] + [0] * 28 + [3, 4]
+
     #-- envelope shapes
     #-- CONT|ATT|ALT|HOLD
     #-- 0 0 x x  \___
@@ -71,7 +77,8 @@ class YmEnvelopeFPGA():
 
     # set envelope shape register 13
     def set_envelope_shape(self, r):
-        self.__rd = r
+        # only the low 4 bits (CONT|ATT|ALT|HOLD) select the shape
+        self.__rd = r & 15
         # reset state
         #self.__env_reset = 1
 
@@ -107,6 +114,13 @@ class YmEnvelopeFPGA():
     # should be called 1/8 system clock cycles
     def envelope_cycle(self):
 
+        # work on local copies of the chip state, and store them back at the end
+        rd = self.__rd
+        env_gen_cnt = self.__env_gen_cnt
+        env_vol = self.__env_vol
+        env_inc = self.__env_inc
+        env_hold = self.__env_hold
+
         # handle the envelope frequency counter
         env_gen_freq = (self.__rc * 256) + self.__rb
         #-- envelope freqs 1 and 0 are the same.
@@ -117,11 +131,11 @@ class YmEnvelopeFPGA():
 
 
         env_ena = 0
-        if (self.__env_gen_cnt >= env_gen_comp):
-            self.__env_gen_cnt = 0
+        if (env_gen_cnt >= env_gen_comp):
+            env_gen_cnt = 0
             env_ena = 1
         else:
-            self.__env_gen_cnt = (self.__env_gen_cnt + 1)
+            env_gen_cnt = (env_gen_cnt + 1)
 
 
 
@@ -129,81 +143,42 @@ class YmEnvelopeFPGA():
         # update envelope if the envelope frequency counter has signalled
         if (env_ena == 1):
 
-            is_bot      = (self.__env_vol == 0)
-            is_bot_p1   = (self.__env_vol == 1)
-            is_top_m1   = (self.__env_vol == 30)
-            is_top      = (self.__env_vol == 31)
+            # the shape control depends on the volume before it is stepped
+            shape_key = (rd << 5) | (env_inc << 4) | (env_hold << 3) | self.ENV_BOUNDARY[env_vol]
 
             # process hold
-            if (self.__env_hold == 0):
-                if (self.__env_inc == 1):
-                    self.__env_vol = (self.__env_vol + 1) & 31
+            if (env_hold == 0):
+                if (env_inc == 1):
+                    env_vol = (env_vol + 1) & 31
                 else:
-                    self.__env_vol = (self.__env_vol + 31) & 31
-
+                    env_vol = (env_vol + 31) & 31
 
             #-- envelope shape control.
-            # CONT=0
-            if (self.__rd & self.ENV_CONT) == 0:
-                if (self.__env_inc == 0): #-- down
-                    if is_bot_p1:
-                        self.__env_hold = 1
-                else:
-                    if is_top:
-                        self.__env_hold = 1
-            else:
-                # CONT = 1
-                if (self.__rd & self.ENV_HOLD): #-- hold = 1
-                    # CONT=1, HOLD=1
-                    if (self.__env_inc == 0): #-- down
-                        if (self.__rd & self.ENV_ALT): #-- alt
-                            if is_bot:
-                                self.__env_hold = 1
-                        else:
-                            if is_bot_p1:
-                                self.__env_hold = 1
-                    else:
-                        if (self.__rd & self.ENV_ALT): #-- alt
-                            if is_top:
-                                self.__env_hold = 1
-                        else:
-                            if is_top_m1:
-                                self.__env_hold = 1
+            env_hold, env_inc = self.ENV_SHAPE_TABLE[shape_key]
 
-                else:
-                    # CONT=1, HOLD=0
-                    if (self.__rd & self.ENV_ALT): #-- alternate
-                        #print 'alt'
-                        if (self.__env_inc == 0): #-- down
-                            if is_bot_p1:
-                                self.__env_hold = 1
-                            if is_bot:
-                                self.__env_hold = 0
-                                self.__env_inc = 1
-                                #print 'flip down up'
-                        else:
-                            if is_top_m1:
-                                self.__env_hold = 1
-                            if is_top:
-                                self.__env_hold = 0
-                                self.__env_inc = 0
-                                #print 'flip up down'
+        self.__env_gen_cnt = env_gen_cnt
+        self.__env_vol = env_vol
+        self.__env_inc = env_inc
+        self.__env_hold = env_hold
 
     # advance the envelope emulator by provided number of clock cycles
     def tick(self, clocks):
-        for x in range(clocks):
-            # emulate the clock divider
-            #-- / 8 when SEL is high and /16 when SEL is low
-
-            ena_div = 0
-            if (self.__cnt_div == 0):
-                self.__cnt_div = 7 #(not I_SEL_L) & "111";
-                ena_div = 1
-            else:
-                self.__cnt_div = self.__cnt_div - 1
+        if clocks <= 0:
+            return
+
+        # emulate the clock divider
+        #-- / 8 when SEL is high and /16 when SEL is low
+        # the divider counts down once per clock, enabling an envelope cycle and
+        # reloading with 7 (not I_SEL_L) & "111" whenever it is 0, so rather than
+        # step through every clock, work out how many times it reaches 0
+        if clocks > self.__cnt_div:
+            cycles = (clocks - self.__cnt_div - 1) // 8 + 1
+        else:
+            cycles = 0
+        self.__cnt_div = (self.__cnt_div - clocks) % 8
 
-            if (ena_div == 1): #-- divider ena
-                self.envelope_cycle()               
+        for x in range(cycles): #-- divider ena
+            self.envelope_cycle()               
 
     def test(self):
         self.reset()
@@ -213,10 +188,79 @@ class YmEnvelopeFPGA():
             self.reset()
             self.set_envelope_shape(m)
             self.set_envelope_freq(0,1) # interval of 1
-            vs = ''
+            # collect the hex digits and join them once, rather than growing a string
+            vs = []
             for n in range(128):
                 v = self.get_envelope_volume() >> 1
-                vs += format(v, 'x')
+                vs.append(format(v, 'x'))
                 self.envelope_cycle()
 
-            print('output volume M=' + str(format(m, 'x')) + ' - ' + vs)
+            print('output volume M=' + str(format(m, 'x')) + ' - ' + ''.join(vs))
+
+
+# the envelope shape control logic from the FPGA, giving the next (env_hold, env_inc)
+# it only depends on the shape, direction, hold state and whether the volume is at or next to the top or bottom
+def envelope_shape_control(rd, env_inc, env_hold, env_vol):
+
+    is_bot      = (env_vol == 0)
+    is_bot_p1   = (env_vol == 1)
+    is_top_m1   = (env_vol == 30)
+    is_top      = (env_vol == 31)
+
+    #-- envelope shape control.
+    # CONT=0
+    if (rd & YmEnvelopeFPGA.ENV_CONT) == 0:
+        if (env_inc == 0): #-- down
+            if is_bot_p1:
+                env_hold = 1
+        else:
+            if is_top:
+                env_hold = 1
+    else:
+        # CONT = 1
+        if (rd & YmEnvelopeFPGA.ENV_HOLD): #-- hold = 1
+            # CONT=1, HOLD=1
+            if (env_inc == 0): #-- down
+                if (rd & YmEnvelopeFPGA.ENV_ALT): #-- alt
+                    if is_bot:
+                        env_hold = 1
+                else:
+                    if is_bot_p1:
+                        env_hold = 1
+            else:
+                if (rd & YmEnvelopeFPGA.ENV_ALT): #-- alt
+                    if is_top:
+                        env_hold = 1
+                else:
+                    if is_top_m1:
+                        env_hold = 1
+
+        else:
+            # CONT=1, HOLD=0
+            if (rd & YmEnvelopeFPGA.ENV_ALT): #-- alternate
+                #print 'alt'
+                if (env_inc == 0): #-- down
+                    if is_bot_p1:
+                        env_hold = 1
+                    if is_bot:
+                        env_hold = 0
+                        env_inc = 1
+                        #print 'flip down up'
+                else:
+                    if is_top_m1:
+                        env_hold = 1
+                    if is_top:
+                        env_hold = 0
+                        env_inc = 0
+                        #print 'flip up down'
+
+    return (env_hold, env_inc)
+
+# precompute the shape control for every combination, indexed by (rd << 5) | (env_inc << 4) | (env_hold << 3) | boundary
+YmEnvelopeFPGA.ENV_SHAPE_TABLE = [ (0, 0) ] * 512
+for rd in range(16):
+    for env_inc in range(2):
+        for env_hold in range(2):
+            for env_vol in (0, 1, 2, 30, 31):
+                shape_key = (rd << 5) | (env_inc << 4) | (env_hold << 3) | YmEnvelopeFPGA.ENV_BOUNDARY[env_vol]
+                YmEnvelopeFPGA.ENV_SHAPE_TABLE[shape_key] = envelope_shape_control(rd, env_inc, env_hold, env_vol)
@@ -22,17 +22,11 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import functools
-import itertools
+import bisect
 import struct
 import sys
-import time
-import binascii
 import math
 import os
-import subprocess
-from os.path import basename
-from string import Formatter
 from timeit import default_timer as timer
 
 FIXED_LENGTH = 0 #50*10 #0 #50* 60
@@ -91,6 +85,13 @@ SID_CLOCK = SID_PAL_CLOCK # set to SID_NTSC_CLOCK or SID_PAL_CLOCK
 YM_CLOCK = 2000000
 YM_RATE = 50 if SID_CLOCK == SID_PAL_CLOCK else 60
 
+# Hz per step of a SID tone, and the YM clock as divided down by the tone generator
+SID_TONE_HZ = SID_CLOCK / 16777216.0
+YM_TONE_CLOCK = YM_CLOCK / 16.0
+
+# YM6 file header, following the 4 byte format identifier (big endian)
+YM_HEADER = struct.Struct('> 8s I I H I H I H')
+
 # TODO:
 # linear-to-logarithmic volume ramp for YM
 # check ADSR calcs are accurate
@@ -191,7 +192,7 @@ stats = Stats()
 
 # Taken from: https://github.com/true-grue/ayumi/blob/master/ayumi.c
 # However, it doesn't marry with the YM2149 spec sheet, nor with the anecdotal reports that the YM attentuation steps in -1.5dB increments. Still, I'm gonna run with the emulator version.
-ym_amplitude_table = [
+ym_amplitude_table = (
     0.0, 0.0,
     0.00465400167849, 0.00772106507973,
     0.0109559777218, 0.0139620050355,
@@ -207,7 +208,7 @@ ym_amplitude_table = [
     0.333730067903, 0.400427252613,
     0.467383840696, 0.53443198291,
     0.635172045472, 0.75800717174,
-    0.879926756695, 1.0 ]
+    0.879926756695, 1.0 )
 
 ### HELPER FUNCTIONS
 ### SHOULD PROBABLY PUT THESE IN A CLASS AT SOME POINT
@@ -220,7 +221,7 @@ def get_sid_frequency(v):
     # (Fn * FCLK / 16777216)
     if v < 1:
         v = 1
-    return float(v) * float(SID_CLOCK) / 16777216.0
+    return v * SID_TONE_HZ
 
 #--------------------------------------------------------------
 # return frequency in hz of a given YM tone/noise pitch
@@ -228,19 +229,23 @@ def get_sid_frequency(v):
 def get_ym_frequency(v):
     if v < 1:
         v = 1
-    ym_freq = (float(YM_CLOCK) / 16.0) / float(v)
+    ym_freq = YM_TONE_CLOCK / v
     return ym_freq
 
 #--------------------------------------------------------------
-# return YM tone from given frequency in hz
+# return unclipped YM tone from given frequency in hz
 #--------------------------------------------------------------
-def frequency_to_ym_tone(f):
-    #global stats
+def get_ym_tone(f):
     # f = (Clock / 16 x TP)
-    tone = int( round( float(YM_CLOCK) / (float(f) * 16.0) ) )
+    return int( round( YM_TONE_CLOCK / f ) )
 
-    stats.max_ym_tone = max([stats.max_ym_tone, tone])
-    stats.min_ym_tone = min([stats.min_ym_tone, tone])
+#--------------------------------------------------------------
+# return given YM tone clipped to 12-bits, and update the stats
+#--------------------------------------------------------------
+def clip_ym_tone(tone):
+    #global stats
+    stats.max_ym_tone = max(stats.max_ym_tone, tone)
+    stats.min_ym_tone = min(stats.min_ym_tone, tone)
 
     if (tone < 0):
         tone = 0
@@ -250,18 +255,34 @@ def frequency_to_ym_tone(f):
         print("WARNING: Tone clipped to 4095")
     return int(tone)
 
+#--------------------------------------------------------------
+# return YM tone from given frequency in hz
+#--------------------------------------------------------------
+def frequency_to_ym_tone(f):
+    return clip_ym_tone( get_ym_tone(f) )
+
 #--------------------------------------------------------------
 # return YM tone from given SID tone
 #--------------------------------------------------------------
 
+# SID tone conversions already worked out, as (SID freq, unclipped YM tone) indexed by SID tone
+# the same tones recur constantly, but the stats are still updated on every conversion
+sid_tone_cache = {}
+
 def sid_tone_to_ym_tone(v):
     #global stats # total_hz_error, worst_hz_error
 
-    f = get_sid_frequency(v)
+    conversion = sid_tone_cache.get(v)
+    if conversion is None:
+        f = get_sid_frequency(v)
+        conversion = (f, get_ym_tone(f))
+        sid_tone_cache[v] = conversion
+    f, tone = conversion
+
     if (f < 30.0):
         print("SID frequency " + str(f) + "hz (tone=" + str(v) + ") too low for YM")
 
-    t = frequency_to_ym_tone(f)
+    t = clip_ym_tone(tone)
     yf = get_ym_frequency(t)
 
     if (v > 0):
@@ -269,7 +290,8 @@ def sid_tone_to_ym_tone(v):
         stats.total_hz_error += error
         if error > stats.worst_hz_error:
             stats.worst_hz_error = error
-        print("SID tone=" + str(v) + ", SID freq=" + str(f) + ", YM tone=" + str(t) + ", YM freq=" + str(yf) + ", (error=" + str(error) + "hz)" )
+        if ENABLE_DEBUG:
+            print("SID tone=" + str(v) + ", SID freq=" + str(f) + ", YM tone=" + str(t) + ", YM freq=" + str(yf) + ", (error=" + str(error) + "hz)" )
         if (error > 1):
             stats.total_large_error_tones += 1
             print("WARNING: LARGE ERROR IN FREQUENCY CONVERSION (" + str(error) + "hz)")
@@ -294,16 +316,12 @@ def get_ym_amplitude(v):
 # given an amplitude (0-1), return the closest matching YM 5-bit volume level
 def get_ym_volume(a):
     if True:
-        dist = 1<<31
-        index = 0
-        for n in range(32):
-            ya = ym_amplitude_table[n]
-            p = a - ya
-            d = p * p
-            # we always round to the nearest louder level (so we are never quieter than target level)
-            if d < dist and ya >= a:
-                dist = d
-                index = n
+        # we always round to the nearest louder level (so we are never quieter than target level)
+        # the amplitude table is in ascending order, so that is the first level >= a
+        index = bisect.bisect_left(ym_amplitude_table, a)
+        if index > 31:
+            # louder than the loudest level
+            index = 0
 
         return index
     else:        
@@ -325,10 +343,16 @@ class SidVoice(object):
     # class statics
 
     # these tables are mappings of ADSR register values to ms/step
-    attack_table = [ 2, 8, 16, 24, 38, 56, 68, 80, 100, 250, 500, 800, 1000, 3000, 5000, 8000 ]
-    decayrelease_table = [ 6, 24, 48, 72, 114, 168, 204, 240, 300, 750, 1500, 2400, 3000, 9000, 15000, 24000 ]
+    attack_table = ( 2, 8, 16, 24, 38, 56, 68, 80, 100, 250, 500, 800, 1000, 3000, 5000, 8000 )
+    decayrelease_table = ( 6, 24, 48, 72, 114, 168, 204, 240, 300, 750, 1500, 2400, 3000, 9000, 15000, 24000 )
     # sustain table maps S of the ADSR registers to a target 8-bit volume from a 4-bit setting
-    sustain_table = [ 0x00, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66, 0x77, 0x88, 0x99, 0xaa, 0xbb, 0xcc, 0xdd, 0xee, 0xff ]
+    sustain_table = ( 0x00, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66, 0x77, 0x88, 0x99, 0xaa, 0xbb, 0xcc, 0xdd, 0xee, 0xff )
+
+    # envelope counter value reached at the end of the nominal attack time
+    ENVELOPE_PRECISION = (2 ** 31)
+
+    # longest interval the envelope is advanced by in one go, in SID clocks (integer, so the envelope counter stays integer)
+    ETICK_RESOLUTION = SID_CLOCK // 8
 
     # Envelope cycles
     EnvelopeCycle_Inactive = 0
@@ -340,7 +364,8 @@ class SidVoice(object):
     def __init__(self, voiceid):
         self.__voiceid = voiceid
         self.reset()
-        print("Sid voice " + str(voiceid) + " initialised.")
+        if ENABLE_DEBUG:
+            print("Sid voice " + str(voiceid) + " initialised.")
 
     def reset(self):
         ### internals
@@ -361,6 +386,7 @@ class SidVoice(object):
 
         ### registers
         self.__gate = False
+        self.__envelope_registers = None
         self.set_frequency(0)#, 0)
         self.set_pulsewidth(0)#, 0)
         self.set_control(0)
@@ -381,8 +407,8 @@ class SidVoice(object):
         self.__pulsewidth = p
 
         stats.pulsewidth_register_updates += 1
-        stats.min_sid_pulsewidth = min([self.__pulsewidth, stats.min_sid_pulsewidth])
-        stats.max_sid_pulsewidth = max([self.__pulsewidth, stats.max_sid_pulsewidth])
+        stats.min_sid_pulsewidth = min(self.__pulsewidth, stats.min_sid_pulsewidth)
+        stats.max_sid_pulsewidth = max(self.__pulsewidth, stats.max_sid_pulsewidth)
 
     def voiceId(self):
         return "V" + str(self.__voiceid) + " "
@@ -419,16 +445,10 @@ class SidVoice(object):
 
         last_gate = self.__gate
 
-        # waveform generators enable flags
-        self.__noise = ((c & 128) == 128)
-        self.__pulse = ((c & 64) == 64)
-        self.__triangle = ((c & 32) == 32)
-        self.__sawtooth = ((c & 16) == 16)
-        # control flags
-        self.__test = ((c & 8) == 8)
-        self.__ringmod = ((c & 4) == 4)
-        self.__sync = ((c & 2) == 2)
-        self.__gate = ((c & 1) == 1)
+        # waveform generators enable flags, control flags, and whether a waveform is active on this voice
+        (self.__noise, self.__pulse, self.__triangle, self.__sawtooth,
+            self.__test, self.__ringmod, self.__sync, self.__gate,
+            self.__wave_active) = SidVoice.CONTROL_FLAGS[c]
 
         stats.control_register_updates += 1
         if self.__pulse:
@@ -446,8 +466,10 @@ class SidVoice(object):
         if self.__ringmod:
             stats.uses_ringmod_bit += 1
 
-        # logic indicator if a waveform is active on this voice
-        self.__wave_active = self.__noise or self.__pulse or self.__triangle or self.__sawtooth
+        # waveform enable masks, all bits set if the waveform is enabled so tick() can just AND them
+        self.__sawtooth_mask = -1 if self.__sawtooth else 0
+        self.__pulse_mask = -1 if self.__pulse else 0
+        self.__triangle_mask = -1 if self.__triangle else 0
 
 
         # handle gate trigger state change
@@ -460,24 +482,30 @@ class SidVoice(object):
                 # gate cleareroff - release cycle triggered
                 self.__envelope_cycle = SidVoice.EnvelopeCycle_Release
 
-        s = ""
-        s += "NOIS " if self.__noise else "---- "
-        s += "PULS " if self.__pulse else "---- "
-        s += "TRIN " if self.__triangle else "---- "
-        s += "SAWT " if self.__sawtooth else "---- "
-        s += "TEST " if self.__test else "---- "
-        s += "SYNC " if self.__sync else "---- "
-        s += "GATE " if self.__gate else "---- "
-        s += " (NO WAVEFORMS ACTIVE)" if not self.__wave_active else ""
-        print(self.voiceId() + "CONTROL set to: " + s)
+        if ENABLE_DEBUG:
+            print(self.voiceId() + "CONTROL set to: " + SidVoice.CONTROL_LABELS[c])
 
     # register 5,6 - envelope (4x 4-bits)
     def set_envelope(self, r1, r2):
+        # rewriting the same ADSR leaves the rates as they are
+        if (r1, r2) == self.__envelope_registers:
+            return
+        self.__envelope_registers = (r1, r2)
+
         self.__attack = (r1 >> 4) & 15
         self.__decay = (r1 & 15)
         self.__sustain = (r2 >> 4) & 15
         self.__release = (r2 & 15)
-        print(self.voiceId() + "ADSR set to A="+str(self.__attack)+", D="+str(self.__decay)+", S="+str(self.__sustain)+", R="+str(self.__release))
+
+        # envelope counter steps per SID clock for each cycle, and the counter target for sustain
+        precision = SidVoice.ENVELOPE_PRECISION
+        self.__attack_rate = int( round( precision / (SidVoice.attack_table[self.__attack] * SID_CLOCK / 1000)))
+        self.__decay_rate = int( round( precision / (SidVoice.decayrelease_table[self.__decay] * SID_CLOCK / 1000)))
+        self.__release_rate = int( round( precision / (SidVoice.decayrelease_table[self.__release] * SID_CLOCK / 1000)))
+        self.__sustain_target = SidVoice.sustain_table[self.__sustain] << 24
+
+        if ENABLE_DEBUG:
+            print(self.voiceId() + "ADSR set to A="+str(self.__attack)+", D="+str(self.__decay)+", S="+str(self.__sustain)+", R="+str(self.__release))
 
 
     # get the current envelope level / amplitude for this voice (0-255)
@@ -515,10 +543,12 @@ class SidVoice(object):
         if (self.__envelope_cycle == SidVoice.EnvelopeCycle_Sustain):
             # if we're in sustain cycle, its an early out because only Gate change will affect it
             # and that cannot happen within this logic
-            print(" - Optimized sustain for voice " + str(self.__voiceid))
+            if ENABLE_DEBUG:
+                print(" - Optimized sustain for voice " + str(self.__voiceid))
             adsr_active = False
         elif (self.__envelope_cycle == SidVoice.EnvelopeCycle_Inactive):
-            print(" - Optimized ADSR for voice " + str(self.__voiceid) + " because Inactive")
+            if ENABLE_DEBUG:
+                print(" - Optimized ADSR for voice " + str(self.__voiceid) + " because Inactive")
             adsr_active = False
 
         # early out if inactive
@@ -540,77 +570,99 @@ class SidVoice(object):
         # envelope process
         # see also https://sourceforge.net/p/vice-emu/code/HEAD/tree/trunk/vice/src/resid/envelope.cc
 
-        precision = (2 ** 31)
-        attack_rate = int( round( precision / (SidVoice.attack_table[self.__attack] * SID_CLOCK / 1000)))
-        decay_rate = int( round( precision / (SidVoice.decayrelease_table[self.__decay] * SID_CLOCK / 1000)))
-        release_rate = int( round( precision / (SidVoice.decayrelease_table[self.__release] * SID_CLOCK / 1000)))
-        sustain_target = SidVoice.sustain_table[self.__sustain] << 24
+        # rates only change when the envelope registers are written, see set_envelope()
+        precision = SidVoice.ENVELOPE_PRECISION
+        attack_rate = self.__attack_rate
+        decay_rate = self.__decay_rate
+        release_rate = self.__release_rate
+        sustain_target = self.__sustain_target
 
 
-        # iterate the ADSR logic for each tick. Suboptimal for now.
+        # iterate the ADSR logic for the whole interval, as a single scaled step where no cycle boundary can be crossed
         iteration_count = t
         iteration_scale = 1
         if (self.__envelope_cycle == SidVoice.EnvelopeCycle_Attack) and ((self.__envelope_counter + attack_rate*t) <= precision):
             iteration_scale = t
             iteration_count = 1
-            print(" - Optimized attack for voice " + str(self.__voiceid))
+            if ENABLE_DEBUG:
+                print(" - Optimized attack for voice " + str(self.__voiceid))
         elif (self.__envelope_cycle == SidVoice.EnvelopeCycle_Decay) and ((self.__envelope_counter - decay_rate*t) > sustain_target):
             iteration_scale = t
             iteration_count = 1
-            print(" - Optimized decay for voice " + str(self.__voiceid))
+            if ENABLE_DEBUG:
+                print(" - Optimized decay for voice " + str(self.__voiceid))
         elif (self.__envelope_cycle == SidVoice.EnvelopeCycle_Release) and ((self.__envelope_counter - release_rate*t) >= 0):
             iteration_scale = t
             iteration_count = 1
-            print(" - Optimized release for voice " + str(self.__voiceid))
+            if ENABLE_DEBUG:
+                print(" - Optimized release for voice " + str(self.__voiceid))
         elif (self.__envelope_cycle == SidVoice.EnvelopeCycle_Sustain):
             # if we're in sustain cycle, its an early out because only Gate change will affect it
             iteration_count = 1
             adsr_active = False
-            print(" - Optimized sustain for voice " + str(self.__voiceid))
+            if ENABLE_DEBUG:
+                print(" - Optimized sustain for voice " + str(self.__voiceid))
         elif (self.__envelope_cycle == SidVoice.EnvelopeCycle_Inactive):
             iteration_count = 1
             adsr_active = False
-            print(" - Optimized ADSR for voice " + str(self.__voiceid) + " because Inactive")
+            if ENABLE_DEBUG:
+                print(" - Optimized ADSR for voice " + str(self.__voiceid) + " because Inactive")
         else:
-            print(" - " + str(iteration_count) + " ADSR Iterations for voice " + str(self.__voiceid) + ", cycle=" + str(self.__envelope_cycle))
+            if ENABLE_DEBUG:
+                print(" - " + str(iteration_count) + " ADSR Iterations for voice " + str(self.__voiceid) + ", cycle=" + str(self.__envelope_cycle))
 
         #elif (self.__envelope_cycle == SidVoice.EnvelopeCycle_Decay) and ((self.__envelope_counter - decay_rate*t) > 0):
         #    t = 1
 
-        for n in range(iteration_count):
-            #print("Iteration count=" + str(iteration_count) + ", n=" + str(n) + ", " #" + str(n))
-            if self.__envelope_cycle == SidVoice.EnvelopeCycle_Inactive:
-                # nothing to do
-                break
+        # rather than step the ADSR logic once per tick, work out how many ticks it takes
+        # to reach the next cycle boundary and jump straight to it (or to the end of the interval)
+        cycle = self.__envelope_cycle
+        counter = self.__envelope_counter
+        level = self.__envelope_level
+        while iteration_count > 0:
             # attack cycle
-            elif self.__envelope_cycle == SidVoice.EnvelopeCycle_Attack:
-                self.__envelope_counter += attack_rate * iteration_scale
-                self.__envelope_level = self.__envelope_counter >> 24
-                if self.__envelope_level >= 255:
-                    self.__envelope_level = 255
-                    self.__envelope_cycle = SidVoice.EnvelopeCycle_Decay
+            if cycle == SidVoice.EnvelopeCycle_Attack:
+                rate = attack_rate * iteration_scale
+                n = max(1, -((counter - (255 << 24)) // rate))
+                if n > iteration_count:
+                    counter += rate * iteration_count
+                    level = counter >> 24
+                    break
+                counter += rate * n
+                level = 255
+                cycle = SidVoice.EnvelopeCycle_Decay
+                iteration_count -= n
             # decay cycle
-            elif self.__envelope_cycle == SidVoice.EnvelopeCycle_Decay:
-                self.__envelope_counter -= decay_rate * iteration_scale
-                if self.__envelope_counter <= sustain_target:
-                    self.__envelope_counter = sustain_target 
-                    self.__envelope_cycle = SidVoice.EnvelopeCycle_Sustain
-                self.__envelope_level = self.__envelope_counter >> 24
-            elif self.__envelope_cycle == SidVoice.EnvelopeCycle_Sustain:
-                # sustain cycle
-                # nothing to do
-                # possibly check if sustain register has changed
-                # cant change in this loop, so break
+            elif cycle == SidVoice.EnvelopeCycle_Decay:
+                rate = decay_rate * iteration_scale
+                n = max(1, -((sustain_target - counter) // rate))
+                if n > iteration_count:
+                    counter -= rate * iteration_count
+                    level = counter >> 24
+                    break
+                counter = sustain_target
+                level = counter >> 24
+                cycle = SidVoice.EnvelopeCycle_Sustain
                 break
-                
-            elif self.__envelope_cycle == SidVoice.EnvelopeCycle_Release:
-                # release cycle
-                self.__envelope_counter -= release_rate * iteration_scale
-                self.__envelope_level = self.__envelope_counter >> 24
-                if self.__envelope_level <= 0:
-                    self.__envelope_level = 0
-                    self.__envelope_cycle = SidVoice.EnvelopeCycle_Inactive
+            # release cycle
+            elif cycle == SidVoice.EnvelopeCycle_Release:
+                rate = release_rate * iteration_scale
+                n = max(1, (counter - (1 << 24)) // rate + 1)
+                if n > iteration_count:
+                    counter -= rate * iteration_count
+                    level = counter >> 24
                     break
+                counter -= rate * n
+                level = 0
+                cycle = SidVoice.EnvelopeCycle_Inactive
+                break
+            else:
+                # sustain or inactive cycle, nothing to do
+                break
+
+        self.__envelope_cycle = cycle
+        self.__envelope_counter = counter
+        self.__envelope_level = level
 
         return adsr_active
 
@@ -631,12 +683,8 @@ class SidVoice(object):
         triangle_invert = 2047 if (self.__accumulator & 8388608) else 0
         triangle_level = (((self.__accumulator >> 4) ^ triangle_invert) << 1) & 4095
 
-        sawtooth_level = sawtooth_level if self.__sawtooth else 0
-        pulse_level = pulse_level if self.__pulse else 0
-        triangle_level = triangle_level if self.__triangle else 0
-
-        # waveform generator outputs are AND'ed together
-        self.__waveform_level = sawtooth_level & pulse_level & triangle_level
+        # waveform generator outputs are AND'ed together, disabled waveforms are masked to 0
+        self.__waveform_level = (sawtooth_level & self.__sawtooth_mask) & (pulse_level & self.__pulse_mask) & (triangle_level & self.__triangle_mask)
 
         # update envelope generator
 
@@ -645,12 +693,12 @@ class SidVoice(object):
         # We sub divide the incoming tick interval
         # to optimize ADSR intervals for faster processing 
         # which improves performance by a significant factor
+        # (tick_envelope() jumps straight to each cycle boundary within a sub interval)
         et = t
 
-        ETICK_RESOLUTION = SID_CLOCK / 8
         while (et > 0):
 
-            lt = ETICK_RESOLUTION
+            lt = SidVoice.ETICK_RESOLUTION
             if (lt > et):
                 lt = et
 
@@ -669,13 +717,40 @@ class SidVoice(object):
 
 
 
+# the control register flags as displayed in debug output
+def sid_control_label(c):
+    s = ""
+    s += "NOIS " if (c & 128) else "---- "
+    s += "PULS " if (c & 64) else "---- "
+    s += "TRIN " if (c & 32) else "---- "
+    s += "SAWT " if (c & 16) else "---- "
+    s += "TEST " if (c & 8) else "---- "
+    s += "SYNC " if (c & 2) else "---- "
+    s += "GATE " if (c & 1) else "---- "
+    s += " (NO WAVEFORMS ACTIVE)" if not (c & 0xf0) else ""
+    return s
+
+# precompute the label for every control register value
+SidVoice.CONTROL_LABELS = [ sid_control_label(c) for c in range(256) ]
+
+# the control register flags as unpacked by set_control
+# (noise, pulse, triangle, sawtooth, test, ringmod, sync, gate, wave_active)
+def sid_control_flags(c):
+    flags = tuple(((c >> b) & 1) == 1 for b in (7, 6, 5, 4, 3, 2, 1, 0))
+    return flags + ((c & 0xf0) != 0,)
+
+# precompute the flags for every control register value
+SidVoice.CONTROL_FLAGS = [ sid_control_flags(c) for c in range(256) ]
+
+
 # Class to manage simulated state of a SID chip
 # 3 Voices are indexed as 0/1/2
 class SidState(object):
 
     
     def __init__(self):
-        print("Sid Emulator!")
+        if ENABLE_DEBUG:
+            print("Sid Emulator!")
         self.reset()
 
     def reset(self):
@@ -707,13 +782,14 @@ class SidState(object):
         self.__filter_voice3 = (fc & 4) == 4
         self.__filter_ext = (fc & 8) == 8
 
-        s = ""
-        s += "V1 " if self.__filter_voice1 else "-- "
-        s += "V2 " if self.__filter_voice2 else "-- "
-        s += "V3 " if self.__filter_voice3 else "-- "
-        s += "EX " if self.__filter_ext else "-- "
+        if ENABLE_DEBUG:
+            s = ""
+            s += "V1 " if self.__filter_voice1 else "-- "
+            s += "V2 " if self.__filter_voice2 else "-- "
+            s += "V3 " if self.__filter_voice3 else "-- "
+            s += "EX " if self.__filter_ext else "-- "
 
-        print("FILTER CONTROL set to: " + s)
+            print("FILTER CONTROL set to: " + s)
 
 
     # filter resonance (4-bits) (0-15) where 0 is no resonance
@@ -738,13 +814,14 @@ class SidState(object):
         self.__filter_hi_pass = (m & 4) == 4
         self.__filter_3_off = (m & 8) == 8
 
-        s = ""
-        s += "LO-P " if self.__filter_lo_pass else "---- "
-        s += "BN-P " if self.__filter_bn_pass else "---- "
-        s += "HI-P " if self.__filter_hi_pass else "---- "
-        s += "3OFF " if self.__filter_3_off else "---- "
+        if ENABLE_DEBUG:
+            s = ""
+            s += "LO-P " if self.__filter_lo_pass else "---- "
+            s += "BN-P " if self.__filter_bn_pass else "---- "
+            s += "HI-P " if self.__filter_hi_pass else "---- "
+            s += "3OFF " if self.__filter_3_off else "---- "
 
-        print("FILTER MODE set to: " + s)
+            print("FILTER MODE set to: " + s)
 
 
 
@@ -778,42 +855,33 @@ class SidReader(object):
 
     def read_dump(self):
 
-        content = self.__fd.readlines()
-        content = [x.strip() for x in content] 
-        
         # Format
         # | Frame | Freq Note/Abs WF ADSR Pul | Freq Note/Abs WF ADSR Pul | Freq Note/Abs WF ADSR Pul | FCut RC Typ V |
         
 
 
-        def hex2int(s):
-            #s = s.replace(".", "0")
-            return int(s, 16)
-
         def isSet(s):
             return not "." in s
 
+        # the dump is fixed width, so each field is sliced straight out of its segment
+        # hex fields are converted with int(s, 16) directly, which is quicker than any Python level lookup
+        # voice segment is " Freq Note/Abs WF ADSR Pul "
         def parse_voice(segment):
 
 
             # 16-bits frequency
             freq = segment[1:5]
-            segment = segment[5:]
 
-            # note - ignored
-            note = segment[1:9]
-            segment = segment[9:]
+            # note - ignored (columns 6-13)
 
             # 8-bits control
-            wf = segment[1:3]
-            segment = segment[3:]
+            wf = segment[15:17]
             
             # 16-bits ADSR
-            adsr = segment[:5]
-            segment = segment[5:]
+            adsr = segment[18:22]
 
             # 12-bits Pulse width
-            pul = segment[1:4]
+            pul = segment[23:26]
 
 
             # convert to data
@@ -821,21 +889,35 @@ class SidReader(object):
             data = {}
 
             if isSet(freq):
-                data["freq"] = hex2int(freq)
+                data["freq"] = int(freq, 16)
 
             if isSet(wf):
-                data["wf"] = hex2int(wf)
+                data["wf"] = int(wf, 16)
 
             if isSet(adsr):
-                data["adsr"] = hex2int(adsr)
+                data["adsr"] = int(adsr, 16)
 
             if isSet(pul):
-                data["pul"] = hex2int(pul)
+                data["pul"] = int(pul, 16)
 
 
-            print(data)
+            if ENABLE_DEBUG:
+                print(data)
             return data
 
+        # 4 - Low pass output
+        # 5 - Band pass output
+        # 6 - High pass output
+        # 7 - 3 Off (voice 3 muted)
+        typ_map = {
+            "Low" : 1,
+            "Hi " : 4,
+            "B+H" : 6,
+            "L+B" : 3,
+            "Off" : 8
+        }
+
+        # common segment is " FCut RC Typ V "
         def parse_common(segment):
             
             data = {}
@@ -843,16 +925,14 @@ class SidReader(object):
             # 16-bits frequency cutoff register ($15,$16)
             # bits 3-7 off lo are not used
             cutoff = segment[1:5]
-            segment = segment[5:]
             if isSet(cutoff):
-                data["cutoff"] = hex2int(cutoff)
+                data["cutoff"] = int(cutoff, 16)
 
 
             # 8bit RES/Filter register ($17)
-            rc = segment[1:3]
-            segment = segment[3:]
+            rc = segment[6:8]
             if isSet(rc):
-                rc_v = hex2int(rc)
+                rc_v = int(rc, 16)
                 # resonance (bits 4-7 of register $17)
                 data["res"] = rc_v >> 4
                 # filter enable (bits 0-3 of register $17)
@@ -862,21 +942,8 @@ class SidReader(object):
             #4bit mode filter output register ($18 bits 4-7)
             # "Off" / "Hi " / "Low" / "B+H" / "L+B"
             # Low = 
-            typ = segment[1:4]
-            segment = segment[4:]
-
-
-            # 4 - Low pass output
-            # 5 - Band pass output
-            # 6 - High pass output
-            # 7 - 3 Off (voice 3 muted)
-            typ_map = {
-                "Low" : 1,
-                "Hi " : 4,
-                "B+H" : 6,
-                "L+B" : 3,
-                "Off" : 8
-            }
+            typ = segment[9:12]
+
             if isSet(typ):
                 if typ in typ_map:
                     value = typ_map[typ]
@@ -886,20 +953,20 @@ class SidReader(object):
 
 
             # master volume (register $18 bits 0-3)
-            v = segment[1:2]
+            v = segment[13:14]
             if isSet(v):
-                data["v"] = hex2int(v)
+                data["v"] = int(v, 16)
 
-            print(data)
+            if ENABLE_DEBUG:
+                print(data)
             return data
 
 
 
 
-        # 16 register sets on the YM file
-        self.__regs = []
-        for i in range(16):
-            self.__regs.append( bytearray() )            
+        # 16 register sets on the YM file, stored as one 16 byte row per frame
+        # write_ym() de-interleaves these into the 16 register streams
+        self.__regs = bytearray()
 
         # 16 YM registers per frame
 
@@ -911,6 +978,7 @@ class SidReader(object):
         sid_voice1 = sid.get_voice(0)
         sid_voice2 = sid.get_voice(1)
         sid_voice3 = sid.get_voice(2)
+        sid_voices = (sid_voice1, sid_voice2, sid_voice3)
 
         # stats
         #stats = {}
@@ -935,34 +1003,37 @@ class SidReader(object):
 
         # parse the SID register dump
         header = True
-        for x in content:
+        for x in self.__fd:
 
+            x = x.strip()
             
             if not header:
 
                 stats.total_frames += 1
 
-                # split the frame text into text segments
-                frame = x.split("|")
+                # the frame number is followed by the three fixed width voice segments and the common segment
+                # so just find the end of the frame number rather than splitting the whole line
+                f = x.index("|", 1)
 
-                frameId = int(frame[1])
+                frameId = int(x[1:f])
 
                 # test early out, 10seconds 
                 if (FIXED_LENGTH > 0) and (frameId > FIXED_LENGTH):
                     break
 
-                print("-------------------------------------------")
-                print("Frame #" + str(frameId))
-                print("| Frame | Freq Note/Abs WF ADSR Pul | Freq Note/Abs WF ADSR Pul | Freq Note/Abs WF ADSR Pul | FCut RC Typ V |")
-                print(x)
-                print("")
+                if ENABLE_DEBUG:
+                    print("-------------------------------------------")
+                    print("Frame #" + str(frameId))
+                    print("| Frame | Freq Note/Abs WF ADSR Pul | Freq Note/Abs WF ADSR Pul | Freq Note/Abs WF ADSR Pul | FCut RC Typ V |")
+                    print(x)
+                    print("")
 
                 # decode register data from each voice segment
-                voice1 = parse_voice(frame[2]) # voice1
-                voice2 = parse_voice(frame[3]) # voice2
-                voice3 = parse_voice(frame[4]) # voice3
+                voice1 = parse_voice(x[f+1:f+28]) # voice1
+                voice2 = parse_voice(x[f+29:f+56]) # voice2
+                voice3 = parse_voice(x[f+57:f+84]) # voice3
 
-                common = parse_common(frame[5]) # common data
+                common = parse_common(x[f+85:f+100]) # common data
 
 
                 # common control registers
@@ -983,58 +1054,33 @@ class SidReader(object):
 
 
 
-                # control registers
-                if "wf" in voice1:
-                    sid_voice1.set_control( voice1["wf"] )
-
-                if "wf" in voice2:
-                    sid_voice2.set_control( voice2["wf"] )
+                # the register updates are applied voice by voice, for each register type in turn
+                voices = (voice1, voice2, voice3)
 
-                if "wf" in voice3:
-                    sid_voice3.set_control( voice3["wf"] )
+                # control registers
+                for n in range(3):
+                    if "wf" in voices[n]:
+                        sid_voices[n].set_control( voices[n]["wf"] )
 
                 # pulse widths
-                if "pul" in voice1:
-                    #sid_voice1.set_pulsewidth( voice1["pul"] >> 8, voice1["pul"] & 255 )
-                    sid_voice1.set_pulsewidth( voice1["pul"] )
-
-                if "pul" in voice2:
-                    #sid_voice2.set_pulsewidth( voice2["pul"] >> 8, voice2["pul"] & 255 )
-                    sid_voice2.set_pulsewidth( voice2["pul"] )
-
-                if "pul" in voice3:
-                    #sid_voice3.set_pulsewidth( voice3["pul"] >> 8, voice3["pul"] & 255 )
-                    sid_voice3.set_pulsewidth( voice3["pul"] )
-
-
-                # tones
-                if "freq" in voice1: # and not sid_voice1.isNoise(): 
-                    sid_voice1.set_frequency( voice1["freq"] )
-                    tone1 = sid_tone_to_ym_tone( voice1["freq"] )
-                    registers[0] = tone1 & 255
-                    registers[1] = (tone1 >> 8) & 255
-
-                if "freq" in voice2: # and not sid_voice2.isNoise(): 
-                    sid_voice2.set_frequency( voice2["freq"] )
-                    tone2 = sid_tone_to_ym_tone( voice2["freq"] )
-                    registers[2] = tone2 & 255
-                    registers[3] = (tone2 >> 8) & 255
-
-                if "freq" in voice3: # and not sid_voice3.isNoise():  
-                    sid_voice3.set_frequency( voice3["freq"] )
-                    tone3 = sid_tone_to_ym_tone( voice3["freq"] )
-                    registers[4] = tone3 & 255
-                    registers[5] = (tone3 >> 8) & 255
+                for n in range(3):
+                    if "pul" in voices[n]:
+                        #sid_voices[n].set_pulsewidth( voices[n]["pul"] >> 8, voices[n]["pul"] & 255 )
+                        sid_voices[n].set_pulsewidth( voices[n]["pul"] )
 
 
-                if "adsr" in voice1:
-                    sid_voice1.set_envelope( voice1["adsr"] >> 8, voice1["adsr"] & 255 )
+                # tones, YM tone registers for voice n are 2n (lo) and 2n+1 (hi)
+                for n in range(3):
+                    if "freq" in voices[n]: # and not sid_voices[n].isNoise(): 
+                        sid_voices[n].set_frequency( voices[n]["freq"] )
+                        tone = sid_tone_to_ym_tone( voices[n]["freq"] )
+                        registers[n*2+0] = tone & 255
+                        registers[n*2+1] = (tone >> 8) & 255
 
-                if "adsr" in voice2:
-                    sid_voice2.set_envelope( voice2["adsr"] >> 8, voice2["adsr"] & 255 )
 
-                if "adsr" in voice3:
-                    sid_voice3.set_envelope( voice3["adsr"] >> 8, voice3["adsr"] & 255 )
+                for n in range(3):
+                    if "adsr" in voices[n]:
+                        sid_voices[n].set_envelope( voices[n]["adsr"] >> 8, voices[n]["adsr"] & 255 )
 
                 # select appropriate waveform on YM, noise or square wave
                 ym_mixer_1 = 1 if sid_voice1.isNoise() else 8
@@ -1064,11 +1110,13 @@ class SidReader(object):
                     sid_noise_avg_freq = sid_noise_avg_freq / sid_noise_channels_active
                     sid_noise_avg_freq *= 16.0 # hack because SID noise is much lower freq than YM
                     ym_noise_value = int((YM_CLOCK / sid_noise_avg_freq) / 16.0)
-                    print(str(sid_noise_avg_freq))
-                    print("YM Noise value=" + str(ym_noise_value) + ", from " + str(sid_noise_channels_active) + " active noise voices")
+                    if ENABLE_DEBUG:
+                        print(str(sid_noise_avg_freq))
+                        print("YM Noise value=" + str(ym_noise_value) + ", from " + str(sid_noise_channels_active) + " active noise voices")
                     if ym_noise_value > 31:
                         ym_noise_value = 31
-                        print("YM Noise value CLIPPED to 31")
+                        if ENABLE_DEBUG:
+                            print("YM Noise value CLIPPED to 31")
                     
                     
                     ym_noise_value = 2
@@ -1086,7 +1134,8 @@ class SidReader(object):
                 # handle 3off case
                 if sid.is3off():
                     ym_mixer_3 = (4+32)
-                    print("SID 3OFF SET, so Voice 3 is mute")
+                    if ENABLE_DEBUG:
+                        print("SID 3OFF SET, so Voice 3 is mute")
 
                 # handle test bit as an override on the waveform output
                 #ym_mixer_1 = (1+8) if sid_voice1.isTest() else ym_mixer_1
@@ -1104,7 +1153,8 @@ class SidReader(object):
                     fv = float(sv) / 255.0
                     # convert to logarithmic YM volume
                     ymv = get_ym_volume(fv)
-                    print("SID Volume=" + str(v) + ", YM Volume=" + str(ymv) + ", Linear YM Volume=" + str(v>>3))
+                    if ENABLE_DEBUG:
+                        print("SID Volume=" + str(v) + ", YM Volume=" + str(ymv) + ", Linear YM Volume=" + str(v>>3))
                     return ymv
 
                 # volumes
@@ -1130,8 +1180,7 @@ class SidReader(object):
 
 
                 #print(frame)
-                for i in range(16):
-                    self.__regs[i].append(registers[i])
+                self.__regs.extend(registers)
 
             if ("+-------+" in x):
                 header = False
@@ -1144,34 +1193,37 @@ class SidReader(object):
 
     def write_ym(self, ym_filename):
 
-        nb_frames = len(self.__regs[0])
-
-        # build the full VGM output stream		
-        ym_data = bytearray()
-        ym_data.extend(b'YM6!')            # YM version
-        ym_data.extend(b'LeOnArD!')         # check_string
-        ym_data.extend(struct.pack('>I', nb_frames))	# nb_frames
-        ym_data.extend(struct.pack('>I', 1))	# song_attributes
-        ym_data.extend(struct.pack('>H', 0)) # nb_digidrums
-        ym_data.extend(struct.pack('>I', YM_CLOCK)) # chip_clock
-        ym_data.extend(struct.pack('>H', YM_RATE))	# frames_rate
-        ym_data.extend(struct.pack('>I', 0)) # loop_frame
-        ym_data.extend(struct.pack('>H', 0)) # extra_data
-        ym_data.extend(b'name\0')            # Song name
-        ym_data.extend(b'author\0')            # Author name
-        ym_data.extend(b'comment\0')            # Song comment
-
-        # YM6 requires 16 register sets
+        nb_frames = len(self.__regs) // 16
+
+        # YM version, header, then the song name, author name and song comment strings
+        header = bytearray(b'YM6!')
+        header.extend(YM_HEADER.pack(
+            b'LeOnArD!',    # check_string
+            nb_frames,      # nb_frames
+            1,              # song_attributes
+            0,              # nb_digidrums
+            YM_CLOCK,       # chip_clock
+            YM_RATE,        # frames_rate
+            0,              # loop_frame
+            0))             # extra_data
+        header.extend(b'name\0author\0comment\0')
+
+        # build the full YM output stream in one preallocated buffer
+        # YM6 requires 16 register sets, each register stream is placed with a single strided slice
+        ym_data = bytearray(len(header) + nb_frames * 16 + 4)
+        ym_data[0:len(header)] = header
         for i in range(16):
-            ym_data.extend(self.__regs[i])
+            offset = len(header) + i * nb_frames
+            ym_data[offset:offset + nb_frames] = self.__regs[i::16]
 
-        ym_data.extend(b'End!')            # EOF token
+        ym_data[-4:] = b'End!'            # EOF token
 
 
         # write to output file
-        ym_file = open(ym_filename, 'wb')
-        ym_file.write(ym_data)
-        ym_file.close()
+        # the whole file is already in one buffer, so write it with a single call
+        # and make sure the file is closed even if the write fails
+        with open(ym_filename, 'wb') as ym_file:
+            ym_file.write(ym_data)
 
         print("All done.")
 
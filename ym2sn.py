@@ -29,13 +29,10 @@ import itertools
 import struct
 import sys
 import time
-import binascii
 import math
 import os
 from os.path import basename
 
-PYTHON_VERSION = sys.version_info[0]    # returns 2 or >=3
-
 
 # Command line can override these defaults
 SN_CLOCK = 4000000              # set this to the target SN chip clock speed
@@ -297,6 +294,9 @@ def get_ym_volume(amplitude):
         return v      
 
 
+# table of the amplitude each 5-bit ym volume contributes to the noise mix
+# (each YM channel's noise contributes NOISE_MIX_SCALE of the overall noise volume)
+ym_noise_amplitude_table = [ get_ym_amplitude(v) * NOISE_MIX_SCALE for v in range(32) ]
 
 
 # table to map ym volumes from 5-bit to 4-bit SN volumes
@@ -316,6 +316,37 @@ for n in range(32):
 
     ym_sn_volume_table.append(index)
 
+# table to unpack the 6 mixer bits of YM register R7 into
+# (tone_a, tone_b, tone_c, noise_a, noise_b, noise_c) flags
+# mixer bits are active low, so each flag is True when that output is on
+ym_mixer_table = []
+for n in range(64):
+    ym_mixer_table.append( tuple( (n & (1<<b)) == 0 for b in range(6) ) )
+
+# SN channels that YM channels A, B & C are mapped to, indexed by the YM bass channel
+# the bass channel always goes to SN channel 2, since its tone drives the periodic noise on channel 3
+BASS_CHANNEL_MAPS = [ (2, 1, 0), (0, 2, 1), (0, 1, 2) ]
+
+# Atari ST MFP timer settings, used for digidrum & timer synth playback rates
+MFP_FREQ = 2457600
+MFP_TABLE = [ 1, 4, 10, 16, 50, 64, 100, 200]
+
+# table of MFP timer frequencies in Hz, indexed by [TP][TC]
+# a TC of 0 is not a valid timer setting, so that gives 0
+mfp_freq_table = []
+for tp in range(8):
+    mfp_freq_table.append( [0] + [ MFP_FREQ // MFP_TABLE[tp] // tc for tc in range(1, 256) ] )
+
+# precompiled binary layouts, so the format strings are only parsed once
+# YM5/YM6 file header, following the 4 byte format identifier (big endian)
+YM_HEADER = struct.Struct('> 8s I I H I H I H')
+# size of each digidrum sample that follows the YM header (big endian)
+YM_SAMPLE_SIZE = struct.Struct('>I')
+# VGM 1.51 64 byte file header (little endian)
+VGM_HEADER = struct.Struct('<4sIIIIIIIIIHBBIIIII')
+# GD3 tag header - magic, version, data length
+GD3_HEADER = struct.Struct('<4sII')
+
 
 
 # get the nearest 4-bit logarithmic volume to the given 5-bit ym_volume
@@ -331,6 +362,213 @@ def get_sn_volume(ym_volume):
         return (min(ym_volume+1, 31) >> 1) & 15
         #return (ym_volume >> 1) & 15
 
+# get the number of octaves freq must be raised by to be at least baseline_freq
+def get_octave_shift(freq, baseline_freq):
+    if freq <= 0 or freq >= baseline_freq:
+        return 0
+    n = int(math.ceil(math.log(baseline_freq / freq, 2)))
+    # the log can be out by one due to float rounding, so nudge it
+    # until it matches what repeatedly doubling freq would give
+    while n > 0 and math.ldexp(freq, n-1) >= baseline_freq:
+        n -= 1
+    while math.ldexp(freq, n) < baseline_freq:
+        n += 1
+    return n
+
+# return key1 if the given bit is set in data, otherwise key0
+def getregisterflag(data,bit,key0,key1):
+    if data & (1<<bit):
+        return key1
+    else:
+        return key0      
+
+# frame info text for the 6 mixer bits of YM register R7, so it can be looked up rather than built per frame
+# output is on when mix bit is clear
+ym_mixer_info_table = []
+for n in range(64):
+    ym_mixer_info_table.append( ", Tone Mix [ " + " ".join( [ getregisterflag(n, b, "abc"[b], "-") for b in range(3) ] ) + " ]"
+                              + ", Noise Mix [ " + " ".join( [ getregisterflag(n, b+3, "abc"[b], "-") for b in range(3) ] ) + " ]" )
+
+# frame info text for the envelope mode bits of channels A, B & C (bit 0 = A, bit 1 = B, bit 2 = C)
+ym_envelope_info_table = []
+for n in range(8):
+    ym_envelope_info_table.append( ", Env [ " + " ".join( [ getregisterflag(n, b, "-", "abc"[b]) for b in range(3) ] ) + " ]" )
+
+#--------------------------------------------------------------
+# return frequency in hz of a given YM tone/noise pitch
+# clock is the YM chip clock
+#--------------------------------------------------------------
+def get_ym_frequency(v, clock):
+    if v < 1:
+        v = 1
+    return clock / (16 * v)
+
+# return the distance between two frequencies
+def get_freq_dist(f1, f2):
+    d = f1 - f2
+    return math.sqrt(d*d)
+
+#--------------------------------------------------------------
+# given a YM tone period, return the equivalent SN tone register period
+# clock is the YM chip clock, vgm_clock is the SN chip clock
+#--------------------------------------------------------------
+def ym_to_sn(ym_tone, clock, vgm_clock, is_periodic = False):
+
+    transposed = 0
+    # Adjust freq scale & baseline range if periodic noise selected
+    baseline_freq = float(vgm_clock) / (2.0 * float(TONE_RANGE) * 16.0)
+    sn_freq_scale = 1.0
+    if is_periodic:
+        sn_freq_scale = float(LFSR_BIT)
+        baseline_freq = float(vgm_clock) / (2.0 * float(TONE_RANGE) * 16.0 * float(LFSR_BIT))
+
+    # tones should never exceed 12-bit range
+    # but some YM files encode extra info
+    # into the top 4 bits
+
+    if ym_tone > 4095:
+        print(" ERROR: tone data ("+str(ym_tone)+") is out of range (0-4095)")
+        ym_tone = ym_tone & 4095
+
+    # If the tone is 0, it's probably because
+    # there's a digidrum being played on this voice
+    if ym_tone == 0:
+        if ENABLE_VERBOSE:
+            print(" ERROR: ym tone is 0")
+        ym_freq = 0
+        target_freq = 0
+    else:
+        ym_freq = (float(clock) / 16.0) / float(ym_tone)
+
+
+
+        # if the frequency goes below the range
+        # of the SN capabilities, add enough octaves to bring it back in range
+        transposed = get_octave_shift(ym_freq, baseline_freq)
+        target_freq = math.ldexp(ym_freq, transposed)
+
+    # calculate the appropriate SN tone register value
+    if target_freq == 0:
+        sn_tone = 0
+        sn_freq = 0
+    else:
+        sn_tone = float(vgm_clock) / (2.0 * target_freq * 16.0 * sn_freq_scale )
+        # due to the integer maths, some precision is lost at the lower end
+        sn_tone = int(round(sn_tone))	# using round minimizes error margin at lower precision
+
+        # clamp range to 10 bits (or adjust if bit bass enabled)
+        if ENABLE_SOFTWARE_BASS:
+            if sn_tone > 1023:
+                sn_tone >>= 2       # reduce tone frequency by 2 octaves
+                sn_tone |= 16384    # set bit 15 (bit 6 of DATA byte)
+                #print " INFO: Exported bit bass tone (target_freq="+str(target_freq)+" Hz)"
+        else:
+            if sn_tone > 1023:
+                sn_tone = 1023
+                print(" WARNING: Clipped SN tone to 1023 (target_freq="+str(target_freq)+" Hz)")
+                # this could result in bad tuning, depending on why it occurred. better to reduce freq?
+
+
+
+        if sn_tone < 1:
+            sn_tone = 1
+            print(" WARNING: Clipped SN tone to 1 (target_freq="+str(target_freq)+" Hz)")
+
+        sn_freq = float(vgm_clock) / (2.0 * float(sn_tone) * 16.0 * sn_freq_scale)
+
+    if ENABLE_DEBUG:
+        sp = ""
+        if is_periodic:
+            sp = " (PERIODIC)"
+        print("   ym_tone=" + str(ym_tone) + " ym_freq="+str(ym_freq) + ", sn_tone="+str(sn_tone) + " sn_freq="+str(sn_freq) + ", transposed " + str(transposed) + " octaves" + sp)
+
+    hz_err = sn_freq - ym_freq
+    if hz_err > 2.0 or hz_err < -2.0:
+        if ENABLE_VERBOSE:
+            print(" WARNING: Large error transposing tone! [" + str(hz_err) + " Hz ], Periodic=" + str(is_periodic))
+
+    return sn_tone
+
+#--------------------------------------------------------------
+# As above, but for periodic white noise
+#--------------------------------------------------------------
+def ym_to_sn_periodic(ym_tone, clock, vgm_clock):
+
+    # lowest SN periodic noise frequency
+    sn_pfreq_lo = float(vgm_clock) / (2.0 * float(TONE_RANGE) * 16.0 * float(LFSR_BIT))
+
+    # tones should never exceed 12-bit range
+    # but some YM files encode extra info
+    # into the top 4 bits
+    if ym_tone > 4095:
+        print(" ERROR: tone data ("+str(ym_tone)+") is out of range (0-4095)")
+        ym_tone = ym_tone & 4095
+
+    # If the tone is 0, it's probably because
+    # there's a digidrum being played on this voice
+    if ym_tone == 0:
+        if ENABLE_VERBOSE:
+            print(" ERROR: ym tone is 0")
+        ym_freq = 0
+    else:
+        ym_freq = (float(clock) / 16.0) / float(ym_tone)
+
+    # if the frequency goes below the range
+    # of the SN capabilities, add enough octaves to bring it back in range
+    transposed = get_octave_shift(ym_freq, sn_pfreq_lo)
+    if transposed:
+        ym_freq = math.ldexp(ym_freq, transposed)
+        if ENABLE_VERBOSE:
+            print(" WARNING: Freq too low - Added " + str(transposed) + " octaves - now " + str(ym_freq) + "Hz")
+
+    sn_tone = float(vgm_clock) / (2.0 * ym_freq * 16.0 * float(LFSR_BIT) )
+
+    # due to the integer maths, some precision is lost at the lower end
+    sn_tone = int(round(sn_tone))	# using round minimizes error margin at lower precision
+
+    # clamp range to 10 bits (or adjust if bit bass enabled)
+    if ENABLE_SOFTWARE_BASS:
+        if sn_tone > 1023:
+            sn_tone >>= 2
+            sn_tone |= 16384 
+            print(" WARNING: Exported bit bass tone in periodic noise ?? (target_freq="+str(target_freq)+" Hz)")
+            # this could result in bad tuning, depending on why it occurred. better to reduce freq?
+    else:
+        if sn_tone > 1023:
+            sn_tone = 1023
+            print(" WARNING: Clipped SN tone to 1023 (ym_freq="+str(ym_freq)+" Hz)")
+
+
+
+    if sn_tone < 1:
+        sn_tone = 1
+        print(" WARNING: Clipped SN tone to 1 (ym_freq="+str(ym_freq)+" Hz)")
+
+    sn_freq = float(vgm_clock) / (2.0 * float(sn_tone) * 16.0 * float(LFSR_BIT))
+
+    #print "ym_tone=" + str(ym_tone) + " ym_freq="+str(ym_freq) + " sn_tone="+str(sn_tone) + " sn_freq="+str(sn_freq)
+
+    hz_err = sn_freq - ym_freq
+    if hz_err > 2.0 or hz_err < -2.0:
+        if ENABLE_VERBOSE:
+            print(" WARNING: Large error transposing tone! [" + str(hz_err) + " Hz ] ")
+
+    return sn_tone
+
+
+#--------------------------------------------------------------
+# return the (tone, periodic noise) lookup tables of ym_to_sn() results for the given clocks
+#--------------------------------------------------------------
+# The tables depend only on the clocks and the command line conversion settings,
+# which are fixed for a run, so they are created once per combination of these and
+# shared by every conversion that uses them (eg. the intro and loop sections of a tune)
+sn_tone_tables = {}
+
+def get_sn_tone_tables(clock, vgm_clock):
+    key = (clock, vgm_clock, LFSR_BIT, TONE_RANGE, ENABLE_SOFTWARE_BASS)
+    if key not in sn_tone_tables:
+        sn_tone_tables[key] = ( [None] * 4096, [None] * 4096 )
+    return sn_tone_tables[key]
 
 
 
@@ -462,6 +700,18 @@ class YmEnvelope():
         createShape(ramp_up, ramp_dn)
         createShape(ramp_up, hold_lo)
 
+        # Pre-convert each shape to its linear amplitudes, since these are what get averaged in tick()
+        # along with a running total of them, so that tick() can sum any span of a shape in one go
+        self.__envelope_amplitudes = []
+        self.__envelope_amplitude_sums = []
+        for shape in self.__envelope_shapes:
+            amplitudes = [ get_ym_amplitude(v) for v in shape ]
+            sums = [ 0.0 ]
+            for amplitude in amplitudes:
+                sums.append( sums[-1] + amplitude )
+            self.__envelope_amplitudes.append( amplitudes )
+            self.__envelope_amplitude_sums.append( sums )
+
         self.reset()
 
     # reset the chip logic state
@@ -485,6 +735,8 @@ class YmEnvelope():
 
         # load initial shape table
         self.__env_table = self.__envelope_shapes[r & 15]
+        self.__env_amplitudes = self.__envelope_amplitudes[r & 15]
+        self.__env_amplitude_sums = self.__envelope_amplitude_sums[r & 15]
 
         # determine if it is a looped shape / mode
         if (r & self.ENV_HOLD) == self.ENV_HOLD or (r & self.ENV_CONT) == 0:
@@ -524,30 +776,42 @@ class YmEnvelope():
         f = self.get_envelope_period() * self.ENV_CLOCK_DIVIDER
         #print " f=" + str(f)
 
-        a = get_ym_amplitude( self.__env_table[self.__env_cnt] )
+        env_cnt = self.__env_cnt
+
+        a = self.__env_amplitudes[env_cnt]
         n = 1
         if (f > 0):
             # the envelope logic runs every ENV_CLOCK_DIVIDER clock cycles
-            # iterate correct number of envelope periods based on the current envelope frequency
+            # work out how many envelope periods have elapsed based on the current envelope frequency
             # we average the outputs processed, as a simple low pass filter to compensate for larger values of clocks and create a sampled output volume
             # TODO: a better resampling filter 
-            while (self.__clock_cnt >= f):	
-
-                self.__env_cnt += 1
-                self.__clock_cnt -= f
-
-
-                # if looping, mask the bottom 6 bits, otherwise clamp at 63
-                if self.__env_hold:
-                    self.__env_cnt = min(63, self.__env_cnt)
+            steps, self.__clock_cnt = divmod(self.__clock_cnt, f)
+            steps = int(steps)
+
+            # the sampled volume covers the shape entries env_cnt to env_cnt+steps,
+            # so rather than stepping through them, sum them from the running totals
+            sums = self.__env_amplitude_sums
+            n += steps
+            if steps == 0:
+                # still on the same entry
+                pass
+            elif self.__env_hold:
+                # not looping, so the counter clamps at 63 and then stays on that entry
+                if env_cnt < 63:
+                    ramp = min(n, 64 - env_cnt)
+                    a = sums[env_cnt + ramp] - sums[env_cnt] + (n - ramp) * self.__env_amplitudes[63]
                 else:
-                    self.__env_cnt &= 63
-
-                # increase number of envelope samples
-                n += 1
-                # add the envelope volume to the sampled volume
-                a += get_ym_amplitude( self.__env_table[self.__env_cnt] )
-                #print "  __env_cnt=" + str(self.__env_cnt) + ", __clock_cnt=" + str(self.__clock_cnt)
+                    a *= n
+                self.__env_cnt = min(63, env_cnt + steps)
+            else:
+                # looping, so the counter wraps around the 64 entries
+                loops, remainder = divmod(n, 64)
+                a = loops * sums[64]
+                if env_cnt + remainder <= 64:
+                    a += sums[env_cnt + remainder] - sums[env_cnt]
+                else:
+                    a += sums[64] - sums[env_cnt] + sums[env_cnt + remainder - 64]
+                self.__env_cnt = (env_cnt + steps) & 63
 
         # output volume is the average volume for the elapsed number of clocks
         self.__env_volume = get_ym_volume( a / n )
@@ -562,13 +826,14 @@ class YmEnvelope():
             self.reset()
             self.set_envelope_shape(m)
             self.set_envelope_freq(0,1) # interval of 1
-            vs = ''
+            # collect the hex digits and join them once, rather than growing a string
+            vs = []
             for n in range(128):
                 v = self.get_envelope_volume() >> 1
-                vs += format(v, 'x')
+                vs.append(format(v, 'x'))
                 self.tick(8)
 
-            print('output volume M=' + str(format(m, 'x')) + ' - ' + vs)
+            print('output volume M=' + str(format(m, 'x')) + ' - ' + ''.join(vs))
 
         #stop
 			
@@ -587,15 +852,23 @@ class YmReader(object):
 
         print("Parsing YM file...")
 
-        self.__fd = fd
+        # read the whole file in one go, and parse it from memory
         self.__filename = fd.name
         self.__filesize = os.path.getsize(fd.name) 
+        self.__raw = bytearray( fd.read() )
+        self.__offset = 0
         self.__parse_header()
         self.__data = []
         if not self.__data:
             self.__read_data()
             self.__check_eof()        
 
+    # return the next size bytes of the file, and move past them
+    def __read(self, size):
+        data = self.__raw[self.__offset:self.__offset+size]
+        self.__offset += size
+        return data
+
     def __parse_extra_infos(self):
         if self.__header['id'] == 'YM2!' or self.__header['id'] == 'YM3!' or  self.__header['id'] == 'YM3b':
             self.__header['song_name'] = self.__filename
@@ -611,22 +884,18 @@ class YmReader(object):
             #def readcstr():
             #    return ''.join(itertools.takewhile('\0'.__ne__, toeof))
 
+            # read a null terminated string
             def readcstr():
-                chars = []
-                while True:
-                    c = self.__fd.read(1)
-                    if c == b'\x00': #chr(0):
-                        return "".join(chars)
-                    #print(c)
-                    chars.append(c.decode("utf-8") )
-
-            #print("here3")
+                end = self.__raw.find(b'\x00', self.__offset)
+                if end < 0:
+                    end = len(self.__raw)
+                chars = self.__raw[self.__offset:end]
+                self.__offset = end + 1
+                return chars.decode("utf-8")
+
             self.__header['song_name'] = readcstr()
-            #print("here4")
             self.__header['author_name'] = readcstr()
-            #print("here5")
             self.__header['song_comment'] = readcstr()
-            #print("here6")
 
     def __parse_header(self):
         # See:
@@ -634,7 +903,7 @@ class YmReader(object):
         # ftp://ftp.modland.com/pub/documents/format_documentation/Atari%20ST%20Sound%20Chip%20Emulator%20YM1-6%20(.ay,%20.ym).txt
 
         # Parse the YM file format identifier first
-        ym_format = self.__fd.read(4)
+        ym_format = self.__read(4)
         ym_format = ym_format.decode("utf-8") 
         print("YM Format: " + ym_format)
 
@@ -656,8 +925,6 @@ class YmReader(object):
         else:
             if ym_format == 'YM6!' or ym_format == 'YM5!':
                 # Then parse the rest based on version
-                ym_header = '> 8s I I H I H I H'
-                s = self.__fd.read(struct.calcsize(ym_header))
                 (d['check_string'],
                 d['nb_frames'],
                 d['song_attributes'],
@@ -666,7 +933,8 @@ class YmReader(object):
                 d['frames_rate'],
                 d['loop_frame'],
                 d['extra_data'],
-                ) = struct.unpack(ym_header, s)
+                ) = YM_HEADER.unpack_from(self.__raw, self.__offset)
+                self.__offset += YM_HEADER.size
 
                 d['id'] = ym_format
                 d['nb_registers'] = 16
@@ -711,14 +979,15 @@ class YmReader(object):
             for i in range(num_dd):
                 # skip over the digidrums sample file data section for now
                 #print self.__fd.tell()
-                sample_size = struct.unpack('>I', self.__fd.read(4))[0]   # get sample size
+                sample_size = YM_SAMPLE_SIZE.unpack_from(self.__raw, self.__offset)[0]   # get sample size
+                self.__offset += YM_SAMPLE_SIZE.size
 
                 print("Found DigiDrums sample " + str(i) + ", " + str(sample_size) + " bytes, loading data...")
 
                 #print sample_size
                 #print self.__fd.tell()
                 #print "sample " + str(i) + " size="+str(sample_size)
-                self.__fd.seek(sample_size, 1)      # skip the sample data (for now)
+                self.__offset += sample_size      # skip the sample data (for now)
                 #print self.__fd.tell()            
 
 
@@ -739,9 +1008,11 @@ class YmReader(object):
 
         cnt  = self.__header['nb_frames']
 
+        # Store each register stream as a bytearray, so that indexing it
+        # returns the register value as an int on both Python 2.7 and 3.x
         regs = []
         for i in range( self.__header['nb_registers']):
-            buf = self.__fd.read(cnt) # bytearray
+            buf = self.__read(cnt)
             regs.append(buf)            
 
         # support output of just the intro (for tunes with looping sections)       
@@ -781,7 +1052,7 @@ class YmReader(object):
         #print "file offset=" + str(self.__fd.tell())  
 
     def __check_eof(self):
-        if self.__fd.read(4) != 'End!':
+        if self.__read(4) != b'End!':
             print('*Warning* End! marker not found after frames')
 
 
@@ -822,7 +1093,9 @@ class YmReader(object):
         vgm_clock = SN_CLOCK # SN clock speed
 
         # prepare the raw output
+        # this is only needed for the BIN & Arduino outputs, so skip collecting it otherwise
         raw_stream = bytearray()
+        output_raw = ENABLE_BIN or ARDUINO_BIN
 
         # YM has 12 bits of precision
         # Lower values correspond to higher frequencies - see http://poi.ribbon.free.fr/tmp/freq2regs.htm
@@ -855,50 +1128,28 @@ class YmReader(object):
         if ENABLE_TUNED_NOISE:
             print(" + Tuned White Noise is ENABLED [EXPERIMENTAL]")
 
-        def get_register_data(register, frame):
-            return int(binascii.hexlify(regs[register][frame]), 16)
-            
         print("---")
 
-        #print get_register_data(0,0)
-        #print get_register_data(1,0)
-
         # set default volumes at the start of the tune for all channels
         if not self.OUTPUT_LOOP_SECTION:
             dv = 15 # default volume is 15 (silent)
-            vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-            vgm_stream.extend( struct.pack('B', 128+(0<<5)+16+dv) ) # LATCH VOLUME C0
-            vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-            vgm_stream.extend( struct.pack('B', 128+(1<<5)+16+dv) ) # LATCH VOLUME C1
-            vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-            vgm_stream.extend( struct.pack('B', 128+(2<<5)+16+dv) ) # LATCH VOLUME C2
-            vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-            vgm_stream.extend( struct.pack('B', 128+(3<<5)+16+dv) ) # LATCH VOLUME C3 to SILENT
-
-            # set periodic noise on channel 3
-            vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-            vgm_stream.extend( struct.pack('B', 128 + (3 << 5) + 3) ) # LATCH PERIODIC TONE on channel 3    
+            vgm_stream.extend( bytearray((
+                0x50, 128+(0<<5)+16+dv,     # COMMAND, LATCH VOLUME C0
+                0x50, 128+(1<<5)+16+dv,     # COMMAND, LATCH VOLUME C1
+                0x50, 128+(2<<5)+16+dv,     # COMMAND, LATCH VOLUME C2
+                0x50, 128+(3<<5)+16+dv,     # COMMAND, LATCH VOLUME C3 to SILENT
+                # set periodic noise on channel 3
+                0x50, 128 + (3 << 5) + 3    # COMMAND, LATCH PERIODIC TONE on channel 3
+                )) )
 
         # stats for tracking frequency ranges within music
-        ym_tone_a_max = 0
-        ym_tone_b_max = 0
-        ym_tone_c_max = 0
-
-        ym_tone_a_min = 65536
-        ym_tone_b_min = 65536
-        ym_tone_c_min = 65536
+        # (tone ranges are taken from the decoded tone columns once the tune has been converted)
 
-        # range of noise frequencies
-        ym_noise_max = 0
-        ym_noise_min = 63356
+        # count of frames using each noise frequency, the range is worked out from this at the end
+        ym_noise_hist = [0] * 32
         
-        # range of digidrum playback frequencies
-        ym_dd_freq_min = 65536
-        ym_dd_freq_max = 0        
-
-        # range of envelope frequencies
-        ym_env_freq_min = 65536
-        ym_env_freq_max = 0        
+        # digidrum playback frequencies used, the range is worked out from these at the end
+        ym_dd_freqs = set()
 
         # number of frames using envelopes
         ym_env_count = 0 
@@ -917,193 +1168,39 @@ class YmReader(object):
                         
 
         # Helper functions
-        def get_register_byte(r):
-            # some tunes have incorrect data stream lengths, handle that here.
-            if r < len(regs) and i < self.__header['nb_frames'] and i < len(regs[r]) :
-                n = regs[r][i]
-                        
-                # handle python2.7/3.x bullshit
-                if PYTHON_VERSION > 2:
-                    return int(n)
-                else:
-                    return int(binascii.hexlify(n), 16) # seems to work with Python 2
-
-                # can't figure out how to parse these bytes in a way that runs on both 2.7 and 3.x
-                #try:
-                #    v = int(n)
-                #except:
-                #    # some conversion shit happened.
-                #    v = int( struct.unpack('B', n)[0] ) #n = n # woteva
-                #finally:
-                #    return int(binascii.hexlify(n), 16) # seems to work with Python 2
-                #    # return v
-                #    # return int( struct.unpack('B', n)[0] )
-            else:
-                print("ERROR: Register out of range - bad sample ID or corrupt file?")
-                return 0
 
-        def get_register_word(r):
-            return get_register_byte(r) + get_register_byte(r+1)*256
-
-        def getregisterflag(data,bit,key0,key1):
-            if data & (1<<bit):
-                return key1
-            else:
-                return key0      
+        # return the full stream of register r as cnt values
+        # some tunes have incorrect data stream lengths, so pad those with zeros.
+        def get_register_column(r):
+            column = regs[r][0:cnt]
+            if len(column) < cnt:
+                print("ERROR: Register out of range - bad sample ID or corrupt file?")
+                column += bytearray(cnt - len(column))
+            return column
 
-        #--------------------------------------------------------------
-        # return frequency in hz of a given YM tone/noise pitch
-        #--------------------------------------------------------------
-        def get_ym_frequency(v):
-            if v < 1:
-                v = 1
-            return clock / (16 * v)
+        # return the 12-bit tone period stored in register columns lo/hi for every frame
+        def get_tone_column(lo, hi):
+            return [ (lo[n] + hi[n]*256) & 4095 for n in range(cnt) ]
 
 
         #--------------------------------------------------------------
-        # given a YM tone period, return the equivalent SN tone register period
+        # cached version of ym_to_sn()
         #--------------------------------------------------------------
-        def ym_to_sn(ym_tone, is_periodic = False):
+        # A given YM tone always converts to the same SN tone, so results are kept
+        # in 4096 entry lookup tables (one for square wave tones, one for periodic noise).
+        # Entries are filled on first use, so conversion warnings are only
+        # reported for tones that the tune actually plays.
+        sn_tone_table, sn_periodic_table = get_sn_tone_tables(clock, vgm_clock)
 
-            transposed = 0
-            # Adjust freq scale & baseline range if periodic noise selected
-            baseline_freq = sn_freq_lo
-            sn_freq_scale = 1.0
+        def get_sn_tone(ym_tone, is_periodic = False):
             if is_periodic:
-                sn_freq_scale = float(LFSR_BIT)
-                baseline_freq = sn_pfreq_lo
-
-            # tones should never exceed 12-bit range
-            # but some YM files encode extra info
-            # into the top 4 bits
-
-            if ym_tone > 4095:
-                print(" ERROR: tone data ("+str(ym_tone)+") is out of range (0-4095)")
-                ym_tone = ym_tone & 4095
-                
-            # If the tone is 0, it's probably because
-            # there's a digidrum being played on this voice
-            if ym_tone == 0:
-                if ENABLE_VERBOSE:
-                    print(" ERROR: ym tone is 0")
-                ym_freq = 0
-                target_freq = 0
+                table = sn_periodic_table
             else:
-                ym_freq = (float(clock) / 16.0) / float(ym_tone)
-
-
-
-                # if the frequency goes below the range
-                # of the SN capabilities, add an octave
-                target_freq = ym_freq
-                while target_freq < baseline_freq:
-                    #if ENABLE_DEBUG:
-                    #    print " WARNING: Freq too low - Added an octave - from " + str(ym_freq) + " to " + str(ym_freq*2.0) + "Hz"
-                    target_freq *= 2.0
-                    transposed +=  1
-
-            # calculate the appropriate SN tone register value
-            if target_freq == 0:
-                sn_tone = 0
-                sn_freq = 0
-            else:
-                sn_tone = float(vgm_clock) / (2.0 * target_freq * 16.0 * sn_freq_scale )
-                # due to the integer maths, some precision is lost at the lower end
-                sn_tone = int(round(sn_tone))	# using round minimizes error margin at lower precision
-
-                # clamp range to 10 bits (or adjust if bit bass enabled)
-                if ENABLE_SOFTWARE_BASS:
-                    if sn_tone > 1023:
-                        sn_tone >>= 2       # reduce tone frequency by 2 octaves
-                        sn_tone |= 16384    # set bit 15 (bit 6 of DATA byte)
-                        #print " INFO: Exported bit bass tone (target_freq="+str(target_freq)+" Hz)"
-                else:
-                    if sn_tone > 1023:
-                        sn_tone = 1023
-                        print(" WARNING: Clipped SN tone to 1023 (target_freq="+str(target_freq)+" Hz)")
-                        # this could result in bad tuning, depending on why it occurred. better to reduce freq?
-
-
-
-                if sn_tone < 1:
-                    sn_tone = 1
-                    print(" WARNING: Clipped SN tone to 1 (target_freq="+str(target_freq)+" Hz)")
-
-                sn_freq = float(vgm_clock) / (2.0 * float(sn_tone) * 16.0 * sn_freq_scale)
-
-            if ENABLE_DEBUG:
-                sp = ""
-                if is_periodic:
-                    sp = " (PERIODIC)"
-                print("   ym_tone=" + str(ym_tone) + " ym_freq="+str(ym_freq) + ", sn_tone="+str(sn_tone) + " sn_freq="+str(sn_freq) + ", transposed " + str(transposed) + " octaves" + sp)
-
-            hz_err = sn_freq - ym_freq
-            if hz_err > 2.0 or hz_err < -2.0:
-                if ENABLE_VERBOSE:
-                    print(" WARNING: Large error transposing tone! [" + str(hz_err) + " Hz ], Periodic=" + str(is_periodic))
-
-            return sn_tone
-
-        #--------------------------------------------------------------
-        # As above, but for periodic white noise
-        #--------------------------------------------------------------
-        def ym_to_sn_periodic(ym_tone):
-
-            # tones should never exceed 12-bit range
-            # but some YM files encode extra info
-            # into the top 4 bits
-            if ym_tone > 4095:
-                print(" ERROR: tone data ("+str(ym_tone)+") is out of range (0-4095)")
-                ym_tone = ym_tone & 4095
-
-            # If the tone is 0, it's probably because
-            # there's a digidrum being played on this voice
-            if ym_tone == 0:
-                if ENABLE_VERBOSE:
-                    print(" ERROR: ym tone is 0")
-                ym_freq = 0
-            else:
-                ym_freq = (float(clock) / 16.0) / float(ym_tone)
-
-            # if the frequency goes below the range
-            # of the SN capabilities, add an octave
-            while ym_freq < sn_pfreq_lo:
-                ym_freq *= 2.0
-                if ENABLE_VERBOSE:
-                    print(" WARNING: Freq too low - Added an octave - now " + str(ym_freq) + "Hz")
-
-            sn_tone = float(vgm_clock) / (2.0 * ym_freq * 16.0 * float(LFSR_BIT) )
-            
-            # due to the integer maths, some precision is lost at the lower end
-            sn_tone = int(round(sn_tone))	# using round minimizes error margin at lower precision
-
-            # clamp range to 10 bits (or adjust if bit bass enabled)
-            if ENABLE_SOFTWARE_BASS:
-                if sn_tone > 1023:
-                    sn_tone >>= 2
-                    sn_tone |= 16384 
-                    print(" WARNING: Exported bit bass tone in periodic noise ?? (target_freq="+str(target_freq)+" Hz)")
-                    # this could result in bad tuning, depending on why it occurred. better to reduce freq?
-            else:
-                if sn_tone > 1023:
-                    sn_tone = 1023
-                    print(" WARNING: Clipped SN tone to 1023 (ym_freq="+str(ym_freq)+" Hz)")
-
-
-
-            if sn_tone < 1:
-                sn_tone = 1
-                print(" WARNING: Clipped SN tone to 1 (ym_freq="+str(ym_freq)+" Hz)")
-
-            sn_freq = float(vgm_clock) / (2.0 * float(sn_tone) * 16.0 * float(LFSR_BIT))
-
-            #print "ym_tone=" + str(ym_tone) + " ym_freq="+str(ym_freq) + " sn_tone="+str(sn_tone) + " sn_freq="+str(sn_freq)
-
-            hz_err = sn_freq - ym_freq
-            if hz_err > 2.0 or hz_err < -2.0:
-                if ENABLE_VERBOSE:
-                    print(" WARNING: Large error transposing tone! [" + str(hz_err) + " Hz ] ")
-
+                table = sn_tone_table
+            sn_tone = table[ym_tone]
+            if sn_tone is None:
+                sn_tone = ym_to_sn(ym_tone, clock, vgm_clock, is_periodic)
+                table[ym_tone] = sn_tone
             return sn_tone
 
         #--------------------------------------------------------------
@@ -1143,13 +1240,21 @@ class YmReader(object):
             #if r_hi & 64:
             #    print "DEFINITELY BIT BANGED OUTPUT"
 
-            vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-            vgm_stream.extend( struct.pack('B', r_lo) ) # LATCH TONE
-            vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-            vgm_stream.extend( struct.pack('B', r_hi) ) # DATA TONE
+            vgm_stream.extend( bytearray((0x50, r_lo, 0x50, r_hi)) ) # COMMAND, LATCH TONE, COMMAND, DATA TONE
+
+            if output_raw:
+                raw_stream.extend( bytearray((r_lo, r_hi)) )
+
+        #--------------------------------------------------------------
+        # prebuilt vgm commands for the noise and volume register writes
+        #--------------------------------------------------------------
+        # There are only 16 possible noise latches and 4x16 volume latches, so
+        # the 2-byte vgm command (0x50 + SN data byte) for each one is built
+        # up front rather than packed a byte at a time for every write.
+        sn_noise_commands = [ bytearray((0x50, 128 + (3 << 5) + n)) for n in range(16) ]
 
-            raw_stream.extend( struct.pack('B', r_lo) )
-            raw_stream.extend( struct.pack('B', r_hi) )
+        # bit 4 set for volume, SN volumes are inverted
+        sn_volume_commands = [ [ bytearray((0x50, 128 + (c << 5) + 16 + (15 - v))) for v in range(16) ] for c in range(4) ]
 
         #--------------------------------------------------------------
         # output a noise tone on channel 3
@@ -1164,25 +1269,20 @@ class YmReader(object):
             if bad_noise_value and bad_tuned_noise_value:
                 print("WARNING: Detected unusual noise note - " + str(tone))
 
-            r_lo = 128 + (3 << 5) + (tone & 15)
-
-            vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-            vgm_stream.extend( struct.pack('B', r_lo) ) # LATCH TONE
-
-            raw_stream.extend( struct.pack('B', r_lo) ) # LATCH TONE
+            command = sn_noise_commands[tone & 15]
+            vgm_stream.extend( command ) # COMMAND + LATCH TONE
+            if output_raw:
+                raw_stream.append( command[1] ) # LATCH TONE
         
 
         #--------------------------------------------------------------
         # given a channel and volume value, output vgm command
         #--------------------------------------------------------------
         def output_sn_volume(channel, volume):
-
-            r_lo = 128 + (channel << 5) + 16 + (15 - (volume & 15))    # bit 4 set for volume, SN volumes are inverted
-
-            vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-            vgm_stream.extend( struct.pack('B', r_lo) ) # LATCH VOLUME
-
-            raw_stream.extend( struct.pack('B', r_lo) ) # LATCH VOLUME
+            command = sn_volume_commands[channel][volume & 15]
+            vgm_stream.extend( command ) # COMMAND + LATCH VOLUME
+            if output_raw:
+                raw_stream.append( command[1] ) # LATCH VOLUME
 
         #--------------------------------------------------------------
         # YM stream pre-processing code
@@ -1194,19 +1294,31 @@ class YmReader(object):
         channel_lof_multi3 = 0
         envelope_count = 0
 
+        # The tone periods are needed by both the analysis pass and the main
+        # conversion loop, so decode them once for the whole tune.
+        ym_registers = [ get_register_column(r) for r in range(len(regs)) ]
+
+        ym_tone_a_column = get_tone_column(ym_registers[0], ym_registers[1])
+        ym_tone_b_column = get_tone_column(ym_registers[2], ym_registers[3])
+        ym_tone_c_column = get_tone_column(ym_registers[4], ym_registers[5])
+
+        # All of the register values, as one tuple per frame
+        ym_frames = list(zip(*ym_registers))
+
         for i in range(cnt):
-            ym_tone_a = get_register_word(0) & 4095
-            ym_tone_b = get_register_word(2) & 4095
-            ym_tone_c = get_register_word(4) & 4095
+            frame = ym_frames[i]
+            ym_tone_a = ym_tone_a_column[i]
+            ym_tone_b = ym_tone_b_column[i]
+            ym_tone_c = ym_tone_c_column[i]
 
-            ym_freq_a = get_ym_frequency(ym_tone_a)
-            ym_freq_b = get_ym_frequency(ym_tone_b)
-            ym_freq_c = get_ym_frequency(ym_tone_c)
+            ym_freq_a = get_ym_frequency(ym_tone_a, clock)
+            ym_freq_b = get_ym_frequency(ym_tone_b, clock)
+            ym_freq_c = get_ym_frequency(ym_tone_c, clock)
 
             # envelope attentuation mode flags
-            ym_envelope_a = get_register_byte( 8) & 16
-            ym_envelope_b = get_register_byte( 9) & 16
-            ym_envelope_c = get_register_byte(10) & 16
+            ym_envelope_a = frame[8] & 16
+            ym_envelope_b = frame[9] & 16
+            ym_envelope_c = frame[10] & 16
 
             # low freq analysis
             lof_channels = 0
@@ -1278,23 +1390,38 @@ class YmReader(object):
         sn_tone_out = [0, 0, 0, 0]
 
         #--------------------------------------------------------------
-        # YM stream processing code
+        # Per-frame constants
         #--------------------------------------------------------------
-        # Scan the YM stream one frame at a time
-        for i in range(cnt):
-            secs = int(i / frame_rate)
-            mins = int(secs / 60)
-            secs = secs % 60
-            cycle = int(i % frame_rate)
+        # These do not change from one frame to the next, so we set them up
+        # once here rather than recalculating them inside the frame loop.
+        ymenv = self.__ymenv
+        nb_registers = self.__header['nb_registers']
+
+        # the YM envelope counter is clocked at 1/8 of the chip clock, so an envelope period converts to Hz as env_clock / period
+        env_clock = float(clock) / 8.0
+
+        # Envelope shape names, for the frame info output
+        env_shapes = [ "\\___", "\\___", "\\___", "\\___", "/___", "/___", "/___", "/___", "\\\\\\\\", "\\___", "\\/\\/", "\\---", "////", "/---", "/\\/\\", "/___"]
 
-            s = "Frame="
-            s += '{:05d}'.format(i)+" "
-            s += "("
-            s += '{:02d}'.format(mins)+":"
-            s += '{:02d}'.format(secs)+"."
-            s += '{:02d}'.format(cycle)+")"
+        # some of the noise frequencies are impercetible, so filter these out
+        NOISE_FREQ_FILTER = 1
 
+        # SN fixed white noise frequencies
+        sn_noise_freq_0 = float(vgm_clock) / (32.0 * 16.0) # 7.8 Khz @ 4Mhz
+        sn_noise_freq_1 = float(vgm_clock) / (32.0 * 32.0) # 3.9 Khz @ 4Mhz
+        sn_noise_freq_2 = float(vgm_clock) / (32.0 * 64.0) # 1.9 Khz @ 4Mhz
 
+        # Volume sampling rate per frame, and the number of YM clocks the envelope advances per sample
+        sample_rate = SAMPLE_RATE # 1 # 441 # / SAMPLE_RATE # 63 # 700Hz
+        sample_interval = 882 // sample_rate
+        env_tick_clocks = clock / (50*sample_rate)
+
+        #--------------------------------------------------------------
+        # YM stream processing code
+        #--------------------------------------------------------------
+        # Scan the YM stream one frame at a time
+        for i in range(cnt):
+            frame = ym_frames[i]
 
             #------------------------------------------------
             # Conversion Logic
@@ -1309,9 +1436,9 @@ class YmReader(object):
 
             # volume attenuation level (if bit 4 is clear)
             # we convert the 4-bit value to 5-bits so we're always working in higher precision
-            ym_volume_a = (get_register_byte(8) & 15) << 1 
-            ym_volume_b = (get_register_byte(9) & 15) << 1
-            ym_volume_c = (get_register_byte(10) & 15) << 1
+            ym_volume_a = (frame[8] & 15) << 1 
+            ym_volume_b = (frame[9] & 15) << 1
+            ym_volume_c = (frame[10] & 15) << 1
 
             # ensure the new 5-bit value occupies the full 5-bit range (0-31 instead of 0-30) by OR'ing bit 1 to bit 0
             # by duplicating the least significant bit
@@ -1323,39 +1450,34 @@ class YmReader(object):
 
 
             # envelope attentuation mode flags
-            ym_envelope_a = get_register_byte( 8) & 16
-            ym_envelope_b = get_register_byte( 9) & 16
-            ym_envelope_c = get_register_byte(10) & 16
+            ym_envelope_a = frame[8] & 16
+            ym_envelope_b = frame[9] & 16
+            ym_envelope_c = frame[10] & 16
 
             # Tone registers
             # Have to properly mask these registers
             # r1 bits 4-6 are used for TS info
             # r3 bits 4-5 are used for DD info
-            ym_tone_a = get_register_word(0) & 4095
-            ym_tone_b = get_register_word(2) & 4095
-            ym_tone_c = get_register_word(4) & 4095
+            ym_tone_a = ym_tone_a_column[i]
+            ym_tone_b = ym_tone_b_column[i]
+            ym_tone_c = ym_tone_c_column[i]
 
             # Noise register
             # R6 bits 5-6 are used for TP for TS setting
-            ym_noise = get_register_byte(6) & 31
+            ym_noise = frame[6] & 31
 
             # envelope frequency register
-            ym_envelope_f = get_register_word(11)   
+            ym_envelope_f = frame[11] + frame[12]*256   
 
             # envelope shape register (YM format stores 255 if this register should not be updated this frame)
-            ym_envelope_shape = get_register_byte(13)
+            ym_envelope_shape = frame[13]
 
             # mixer flag registers
             # output is on when mix bit is clear. 
             # we invert it though for easier code readibility 
-            ym_mixer = get_register_byte(7)
-            ym_mix_tone_a = (ym_mixer & (1<<0)) == 0
-            ym_mix_tone_b = (ym_mixer & (1<<1)) == 0
-            ym_mix_tone_c = (ym_mixer & (1<<2)) == 0
-
-            ym_mix_noise_a = (ym_mixer & (1<<3)) == 0
-            ym_mix_noise_b = (ym_mixer & (1<<4)) == 0
-            ym_mix_noise_c = (ym_mixer & (1<<5)) == 0
+            ym_mixer = frame[7]
+            (ym_mix_tone_a, ym_mix_tone_b, ym_mix_tone_c,
+             ym_mix_noise_a, ym_mix_noise_b, ym_mix_noise_c) = ym_mixer_table[ym_mixer & 63]
 
             # oddity with "nd-ui.ym" requires this. data shows envelopes enabled on a channel, but tone mixer disabled. a wierd/useless combination. 
             if ENABLE_ENVELOPE_MIX_HACK:
@@ -1398,7 +1520,7 @@ class YmReader(object):
             ts_on = 0
             dd_on = 0
 
-            if self.__header['nb_registers'] == 16:
+            if nb_registers == 16:
                     
                 # digi drums - in YM format, DD triggers are encoded into bits 4+5 of R3
                 # only 1 DD can be triggered per frame, on a specific voice
@@ -1408,8 +1530,8 @@ class YmReader(object):
 
                 # trigger flags for TS and DD
                 # 2 bits where 00=No TS/DD 01=VoiceA 10=VoiceB 11=VoiceC
-                ts_on = (get_register_byte(1) >> 4) & 3
-                dd_on = (get_register_byte(3) >> 4) & 3
+                ts_on = (frame[1] >> 4) & 3
+                dd_on = (frame[3] >> 4) & 3
 
                 #r1 bit b6 is only used if there is a TS running. If b6 is set, YM emulator must restart
                 # the TIMER to first position (you must be VERY sound-chip specialist to hear the difference).
@@ -1422,17 +1544,14 @@ class YmReader(object):
                 # timer/sample rate encodings
                 # TC = Timer Count  (8-bits)
                 # TP = Timer Prediv (3-bits)
-                ts_tp = (get_register_byte(6) >> 5) & 7
-                ts_tc = get_register_byte(14) & 255
+                ts_tp = (frame[6] >> 5) & 7
+                ts_tc = frame[14] & 255
 
-                dd_tp = (get_register_byte(8) >> 5) & 7
-                dd_tc = get_register_byte(15) & 255
+                dd_tp = (frame[8] >> 5) & 7
+                dd_tc = frame[15] & 255
 
     # 4bits volume value (vmax) for TS is stored in the 4 free bits of r5 (b7-b4)
 
-                MFP_FREQ = 2457600
-                MFP_TABLE = [ 1, 4, 10, 16, 50, 64, 100, 200]
-
                 # Handle DD frequency
                 dd_freq = 0
                 if dd_on:
@@ -1444,7 +1563,7 @@ class YmReader(object):
                     if dd_tc == 0:
                         print(" ERROR: Digidrum TC value is 0 - unexpected & unhandled")
                     else:             
-                        dd_freq = int( (MFP_FREQ / MFP_TABLE[dd_tp]) / dd_tc )
+                        dd_freq = mfp_freq_table[dd_tp][dd_tc]
 
                 # Handle TS frequency
                 ts_freq = 0
@@ -1452,7 +1571,7 @@ class YmReader(object):
                     if ts_tc == 0:
                         print(" ERROR: Timer Synth TC value is 0 - unexpected & unhandled")
                     else:
-                        ts_freq = int( (MFP_FREQ / MFP_TABLE[ts_tp]) / ts_tc )
+                        ts_freq = mfp_freq_table[ts_tp][ts_tc]
 
                 # If a DD is triggered on a voice, the volume register for that channel
                 # should be interpreted as a 5-bit sample number rather than a volume
@@ -1466,121 +1585,89 @@ class YmReader(object):
             # show YM frame info
             #------------------------------------------------
 
-            # pitch
-            s += ", Tone ["
-            s += " " + '{:6d}'.format( ym_tone_a )
-            s += " " + '{:6d}'.format( ym_tone_b )
-            s += " " + '{:6d}'.format( ym_tone_c )
-
-
-            # noise
-            #s += ", Noise"
-            s += ", Noise=" + '{:3d}'.format( ym_noise )
-            s += " ]"
-
-            # volume
-            s += ", Vol ["
-            s += " " + '{:2d}'.format( ym_volume_a >> 1 )
-            s += " " + '{:2d}'.format( ym_volume_b >> 1 )
-            s += " " + '{:2d}'.format( ym_volume_c >> 1 )
-            s += " ]"
-
-            # mixer
-            m = get_register_byte(7)
-
-            # output is on when mix bit is clear
-            s += ", Tone Mix ["
-            s += " " + getregisterflag(m,0, "a", "-")
-            s += " " + getregisterflag(m,1, "b", "-")
-            s += " " + getregisterflag(m,2, "c", "-")
-            s += " ]"
-
-            s += ", Noise Mix ["
-            s += " " + getregisterflag(m,3, "a", "-")
-            s += " " + getregisterflag(m,4, "b", "-")
-            s += " " + getregisterflag(m,5, "c", "-")
-            s += " ]"
-            
-
-
-            # envelope
-            s += ", Env ["
-            s += " " + getregisterflag(get_register_byte( 8), 4, "-", "a")
-            s += " " + getregisterflag(get_register_byte( 9), 4, "-", "b")
-            s += " " + getregisterflag(get_register_byte(10), 4, "-", "c")
-            s += " ]"
-
-            # Envelope shape
-            env_shapes = [ "\\___", "\\___", "\\___", "\\___", "/___", "/___", "/___", "/___", "\\\\\\\\", "\\___", "\\/\\/", "\\---", "////", "/---", "/\\/\\", "/___"]
+            # output YM frame data before we mess with it.
+            # the info line is only built when it will be shown, since it is a lot of string formatting per frame
+            if ENABLE_VERBOSE:
+                secs = int(i / frame_rate)
+                mins = int(secs / 60)
+                secs = secs % 60
+                cycle = int(i % frame_rate)
+
+                # Envelope frequency - this is the frequency that the counters will update
+                # and therefore the frequency that a CPU would have to simulate them for accurate sound
+                if ym_envelope_f == 0:
+                    # It's ok, happens when no envelope being used
+                    ehz = 0
+                else:
+                    ehz = env_clock / ym_envelope_f
+
+                s = []
+                s.append("Frame=" + '{:05d}'.format(i) + " ")
+                s.append("(" + '{:02d}'.format(mins) + ":" + '{:02d}'.format(secs) + "." + '{:02d}'.format(cycle) + ")")
+
+                # pitch
+                s.append(", Tone [")
+                s.append(" " + '{:6d}'.format( ym_tone_a ))
+                s.append(" " + '{:6d}'.format( ym_tone_b ))
+                s.append(" " + '{:6d}'.format( ym_tone_c ))
+
+                # noise
+                s.append(", Noise=" + '{:3d}'.format( ym_noise ))
+                s.append(" ]")
+
+                # volume
+                s.append(", Vol [")
+                s.append(" " + '{:2d}'.format( ym_volume_a >> 1 ))
+                s.append(" " + '{:2d}'.format( ym_volume_b >> 1 ))
+                s.append(" " + '{:2d}'.format( ym_volume_c >> 1 ))
+                s.append(" ]")
+
+                # mixer
+                s.append(ym_mixer_info_table[ym_mixer & 63])
+
+                # envelope
+                s.append(ym_envelope_info_table[(ym_envelope_a | (ym_envelope_b << 1) | (ym_envelope_c << 2)) >> 4])
+
+                # Envelope shape
+                s.append(", Env Shape [")
+                if ym_envelope_shape != 255:
+                    s.append(" " + env_shapes[ym_envelope_shape & 15])
+                else:
+                    s.append(" ----")
+                s.append(" ]")
 
+                s.append(", Env Freq [")
+                s.append(" " + '{:6d}'.format( ym_envelope_f ) + " (" + '{:9.2f}'.format( ehz ) + "Hz)")
+                s.append(" ]")
 
-            s += ", Env Shape ["
-            if ym_envelope_shape != 255:
-                s += " " + env_shapes[ym_envelope_shape & 15]
-            else:
-                s += " ----"
-            #s += " " + getregisterflag(ym_envelope_shape,2, "----", " ATT")
-            #s += " " + getregisterflag(ym_envelope_shape,1, "----", " ALT")
-            #s += " " + getregisterflag(ym_envelope_shape,0, "----", "HOLD")
-            s += " ]"
-
-            # Envelope frequency - this is the frequency that the counters will update
-            # and therefore the frequency that a CPU would have to simulate them for accurate sound
-            if ym_envelope_f == 0:
-                #print "WARNING: Envelope frequency is 0 - unexpected & unhandled"
-                # It's ok, happens when no envelope being used
-                ehz = 0
-            else:
-                ehz = (float(clock) / 8.0) / float(ym_envelope_f)
-            
-            s += ", Env Freq ["
-            s += " " + '{:6d}'.format( ym_envelope_f ) + " (" + '{:9.2f}'.format( ehz ) + "Hz)"            
-            s += " ]"
+                # Digi drums extended info (not chip-related, YM format only)
+                if dd_on:
+                    s.append(", Digidrum [")
+                    s.append(" " + str(dd_on))
+                    s.append(" ]")
 
+                    # Sample ID is whatever is in the volume register for the channel
+                    s.append(", Sample [")
+                    s.append(" " +  '{:2d}'.format(frame[7+dd_on]))
+                    s.append(" ]")
 
-            # Digi drums extended info (not chip-related, YM format only)
-            if dd_on:
-                s += ", Digidrum ["
-                s += " " + str(dd_on)
-                s += " ]"
-
-                # Sample ID is whatever is in the volume register for the channel
-                s += ", Sample ["
-                s += " " +  '{:2d}'.format(get_register_byte(7+dd_on))
-                s += " ]"
-            
-                # Sample freq is whatever is in R14 (not sure what R15 is as DD2)
-                s += ", Sample Freq ["
-                s += " " +  '{:6d}'.format(dd_freq)
-                s += " ]"
+                    # Sample freq is whatever is in R14 (not sure what R15 is as DD2)
+                    s.append(", Sample Freq [")
+                    s.append(" " +  '{:6d}'.format(dd_freq))
+                    s.append(" ]")
 
-            # output YM frame data before we mess with it.
-            if ENABLE_VERBOSE:
-                print(s)  
+                print(''.join(s))
 
             #---------------------------------------------------
             # Stats
             #---------------------------------------------------
             # calculate some additional variables
-            ym_tone_a_max = max(ym_tone_a_max, ym_tone_a)
-            ym_tone_b_max = max(ym_tone_b_max, ym_tone_b)
-            ym_tone_c_max = max(ym_tone_c_max, ym_tone_c)
-
-            ym_tone_a_min = min(ym_tone_a_min, ym_tone_a)
-            ym_tone_b_min = min(ym_tone_b_min, ym_tone_b)
-            ym_tone_c_min = min(ym_tone_c_min, ym_tone_c)
-
-            ym_freq_a = get_ym_frequency(ym_tone_a)
-            ym_freq_b = get_ym_frequency(ym_tone_b)
-            ym_freq_c = get_ym_frequency(ym_tone_c)
-
-            ym_env_freq_min = min(ym_env_freq_min, ehz)
-            ym_env_freq_max = max(ym_env_freq_max, ehz)
+            ym_freq_a = get_ym_frequency(ym_tone_a, clock)
+            ym_freq_b = get_ym_frequency(ym_tone_b, clock)
+            ym_freq_c = get_ym_frequency(ym_tone_c, clock)
 
             if dd_on:
-
-                ym_dd_freq_min = min(ym_dd_freq_min, dd_freq)
-                ym_dd_freq_max = max(ym_dd_freq_max, dd_freq)
+                ym_dd_freqs.add(dd_freq)
 
  
             #------------------------------------------------
@@ -1607,15 +1694,12 @@ class YmReader(object):
             if ENABLE_NOISE:
                 if (ym_mix_noise_a or ym_mix_noise_b or ym_mix_noise_c):
 
-                    if ym_mix_noise_a and ym_volume_a > 1: # and not ym_mix_tone_a:
-                        noise_active += 1
-                    if ym_mix_noise_b and ym_volume_b > 1: # and not ym_mix_tone_b:
-                        noise_active += 1
-                    if ym_mix_noise_c and ym_volume_c > 1: # and not ym_mix_tone_c:
-                        noise_active += 1
+                    # each test is a bool, so summing them counts the audible noise channels
+                    noise_active = ( (ym_mix_noise_a and ym_volume_a > 1)     # and not ym_mix_tone_a
+                                   + (ym_mix_noise_b and ym_volume_b > 1)     # and not ym_mix_tone_b
+                                   + (ym_mix_noise_c and ym_volume_c > 1) )   # and not ym_mix_tone_c
 
                     # some of the noise frequencies are impercetible, so filter these out
-                    NOISE_FREQ_FILTER = 1
                     if ym_noise < NOISE_FREQ_FILTER:
                         if ENABLE_DEBUG:
                             print(" Noise frequency (" + str(ym_noise) + ") too high - filtered out")
@@ -1724,53 +1808,19 @@ class YmReader(object):
                     #    bass_channel = FORCE_BASS_CHANNEL
                     
                     # Swap channels according to bass preference
-                    if bass_channel == 0:
-                        # it's A
+                    if bass_channel >= 0 and bass_channel <= 2:
                         if ENABLE_DEBUG:
-                            print("  Channel A -> Bass ")
+                            print("  Channel " + channel_name_map[bass_channel] + " -> Bass ")
 
-                        channel_map_a = 2
-                        channel_map_b = 1
-                        channel_map_c = 0
+                        channel_map_a, channel_map_b, channel_map_c = BASS_CHANNEL_MAPS[bass_channel]
 
-                        sn_tone_out[0] = ym_to_sn(ym_tone_c)
-                        sn_tone_out[1] = ym_to_sn(ym_tone_b)
-                        sn_tone_out[2] = ym_to_sn(ym_tone_a, True)
+                        sn_tone_out[channel_map_a] = get_sn_tone(ym_tone_a, bass_channel == 0)
+                        sn_tone_out[channel_map_b] = get_sn_tone(ym_tone_b, bass_channel == 1)
+                        sn_tone_out[channel_map_c] = get_sn_tone(ym_tone_c, bass_channel == 2)
                         tone_sent = True
-
-
                     else:
-                        if bass_channel == 1:
-                            # it's B
-                            if ENABLE_DEBUG:
-                                print("  Channel B -> Bass ")
-
-                            channel_map_a = 0
-                            channel_map_b = 2
-                            channel_map_c = 1
-
-                            sn_tone_out[0] = ym_to_sn(ym_tone_a)
-                            sn_tone_out[1] = ym_to_sn(ym_tone_c)
-                            sn_tone_out[2] = ym_to_sn(ym_tone_b, True)
-                            tone_sent = True
-
-                        else:
-                            if bass_channel == 2:
-                                # it's C  
-                                if ENABLE_DEBUG:  
-                                    print("  Channel C -> Bass ")
-
-                                channel_map_a = 0
-                                channel_map_b = 1
-                                channel_map_c = 2
-
-                                sn_tone_out[0] = ym_to_sn(ym_tone_a)
-                                sn_tone_out[1] = ym_to_sn(ym_tone_b)
-                                sn_tone_out[2] = ym_to_sn(ym_tone_c, True)
-                                tone_sent = True
-                            else:
-                                # same as above
-                                print(" ERROR2: no bass channel assigned - should not happen!")
+                        # same as above
+                        print(" ERROR2: no bass channel assigned - should not happen!")
 
                      
 
@@ -1778,9 +1828,9 @@ class YmReader(object):
             if not tone_sent:
                 
                 # tones get written anyway, if there's some low frequency tones detected, they'll get modded
-                sn_tone_out[0] = ym_to_sn(ym_tone_a)
-                sn_tone_out[1] = ym_to_sn(ym_tone_b)
-                sn_tone_out[2] = ym_to_sn(ym_tone_c)
+                sn_tone_out[0] = get_sn_tone(ym_tone_a)
+                sn_tone_out[1] = get_sn_tone(ym_tone_b)
+                sn_tone_out[2] = get_sn_tone(ym_tone_c)
 
 
 
@@ -1792,10 +1842,6 @@ class YmReader(object):
             # set to zero if no tuned white noise override is active this frame
 
             if noise_active:
-                sn_noise_freq_0 = float(vgm_clock) / (32.0 * 16.0) # 7.8 Khz @ 4Mhz
-                sn_noise_freq_1 = float(vgm_clock) / (32.0 * 32.0) # 3.9 Khz @ 4Mhz
-                sn_noise_freq_2 = float(vgm_clock) / (32.0 * 64.0) # 1.9 Khz @ 4Mhz
-
                 noise_freq = 0
                 if ym_noise == 0:
                     print(" ERROR: Noise is enabled at frequency 0 - unexpected")
@@ -1803,8 +1849,7 @@ class YmReader(object):
                 else:
                     noise_freq = float(clock) / (16.0 * ym_noise)
 
-                    ym_noise_min = min(ym_noise, ym_noise_min)
-                    ym_noise_max = max(ym_noise, ym_noise_max)
+                    ym_noise_hist[ym_noise] += 1
 
                 #snf = float(vgm_clock) / (16.0 * ym_noise)
                 
@@ -1827,10 +1872,6 @@ class YmReader(object):
                 # clock / 16N
 
                 # find the closest noise frequency on SN to match YM noise frequency
-                def get_freq_dist(f1, f2):
-                    d = f1 - f2
-                    return math.sqrt(d*d)
-
                 if ENABLE_TUNED_NOISE:
                     sn_noise_freq = int( float(vgm_clock) / noise_freq )
 
@@ -1926,7 +1967,7 @@ class YmReader(object):
             if (ENABLE_ENVELOPES):
                 # process envelopes
                 # first set the envelope frequency
-                self.__ymenv.set_envelope_freq(get_register_byte(12), get_register_byte(11))
+                ymenv.set_envelope_freq(frame[12], frame[11])
 
                 # next set the envelope shape, but only if it is set in the YM stream
                 # (since setting this register resets the envelope state)
@@ -1934,28 +1975,26 @@ class YmReader(object):
                 if (ym_envelope_shape != 255):
                     if ENABLE_DEBUG:
                         print('  setting envelope shape ' + format(ym_envelope_shape, '#004b'))
-                    self.__ymenv.set_envelope_shape(ym_envelope_shape)
+                    ymenv.set_envelope_shape(ym_envelope_shape)
 
             # Now we sample the volume repeatedly at the rate given. This has the effect of simulating the envelopes at a better resolution.
-            sample_rate = SAMPLE_RATE # 1 # 441 # / SAMPLE_RATE # 63 # 700Hz
-            sample_interval = 882 / sample_rate
             for sample_loops in range(0,sample_rate):
 
 
                 if (ENABLE_ENVELOPES):
                     # use the envelope volume if M is set for any channel
                     if ym_envelope_a:
-                        ym_volume_a = self.__ymenv.get_envelope_volume()
+                        ym_volume_a = ymenv.get_envelope_volume()
                         if ENABLE_DEBUG:
                             print('  envelope on A')
                     if ym_envelope_b:
                         if ENABLE_DEBUG:
                             print('  envelope on B')
-                        ym_volume_b = self.__ymenv.get_envelope_volume()
+                        ym_volume_b = ymenv.get_envelope_volume()
                     if ym_envelope_c:
                         if ENABLE_DEBUG:
                             print('  envelope on C')
-                        ym_volume_c = self.__ymenv.get_envelope_volume()
+                        ym_volume_c = ymenv.get_envelope_volume()
                 else:
                     # if envelopes are not enabled and we want to simulate envelopes, just use max volume
                     # it's not a great simulation, but prevents some audio being muted
@@ -1984,11 +2023,11 @@ class YmReader(object):
 
                     noise_amplitude = 0.0
                     if ym_mix_noise_a:
-                        noise_amplitude += get_ym_amplitude(ym_volume_a) * NOISE_MIX_SCALE
+                        noise_amplitude += ym_noise_amplitude_table[ym_volume_a]
                     if ym_mix_noise_b:
-                        noise_amplitude += get_ym_amplitude(ym_volume_b) * NOISE_MIX_SCALE
+                        noise_amplitude += ym_noise_amplitude_table[ym_volume_b]
                     if ym_mix_noise_c:
-                        noise_amplitude += get_ym_amplitude(ym_volume_c) * NOISE_MIX_SCALE
+                        noise_amplitude += ym_noise_amplitude_table[ym_volume_c]
 
                     # average the noise amplitude based on number of active noise channels
                     #noise_amplitude /= noise_active
@@ -2014,12 +2053,10 @@ class YmReader(object):
                 # Apply tone mixer settings (will mute channels if not enabled)
                 #------------------------------------------------
 
-                if not ym_mix_tone_a:
-                    ym_volume_a = 0
-                if not ym_mix_tone_b:
-                    ym_volume_b = 0
-                if not ym_mix_tone_c:
-                    ym_volume_c = 0
+                # the mixer flags are bools, so multiplying by them zeroes the volume of a muted channel
+                ym_volume_a *= ym_mix_tone_a
+                ym_volume_b *= ym_mix_tone_b
+                ym_volume_c *= ym_mix_tone_c
 
                 #------------------------------------------------
                 # final output mix of volumes to SN (for tones, bass & noise)
@@ -2189,41 +2226,45 @@ class YmReader(object):
                 #-------------------------------------------------
                 if OPTIMIZE_VGM:
                     # only output register values that have changed since last frame
-                    if sn_tone_out[0] != sn_tone_latch[0]:
-                        sn_tone_latch[0] = sn_tone_out[0]
-                        output_sn_tone(0, sn_tone_latch[0])
-
-                    if sn_tone_out[1] != sn_tone_latch[1]:
-                        sn_tone_latch[1] = sn_tone_out[1]              
-                        output_sn_tone(1, sn_tone_latch[1])
-
-                    if sn_tone_out[2] != sn_tone_latch[2]:
-                        sn_tone_latch[2] = sn_tone_out[2]              
-                        output_sn_tone(2, sn_tone_latch[2])
-
-                    # for the noise channel, only output register writes
-                    # if the noise tone has changed, so that we dont unnecessarily
-                    # reset the LFSR
-                    if sn_tone_out[3] != sn_tone_latch[3]:
-                        sn_tone_latch[3] = sn_tone_out[3]
-                        output_sn_noise(sn_tone_latch[3])
+                    # most frames leave most of the registers unchanged, so compare whole
+                    # frames first, and only check the individual registers if something changed
+                    if sn_tone_out != sn_tone_latch:
+                        if sn_tone_out[0] != sn_tone_latch[0]:
+                            sn_tone_latch[0] = sn_tone_out[0]
+                            output_sn_tone(0, sn_tone_latch[0])
+
+                        if sn_tone_out[1] != sn_tone_latch[1]:
+                            sn_tone_latch[1] = sn_tone_out[1]              
+                            output_sn_tone(1, sn_tone_latch[1])
+
+                        if sn_tone_out[2] != sn_tone_latch[2]:
+                            sn_tone_latch[2] = sn_tone_out[2]              
+                            output_sn_tone(2, sn_tone_latch[2])
+
+                        # for the noise channel, only output register writes
+                        # if the noise tone has changed, so that we dont unnecessarily
+                        # reset the LFSR
+                        if sn_tone_out[3] != sn_tone_latch[3]:
+                            sn_tone_latch[3] = sn_tone_out[3]
+                            output_sn_noise(sn_tone_latch[3])
 
                     # volumes
-                    if sn_attn_out[0] != sn_attn_latch[0]:
-                        sn_attn_latch[0] = sn_attn_out[0]              
-                        output_sn_volume(0, sn_attn_latch[0])
+                    if sn_attn_out != sn_attn_latch:
+                        if sn_attn_out[0] != sn_attn_latch[0]:
+                            sn_attn_latch[0] = sn_attn_out[0]              
+                            output_sn_volume(0, sn_attn_latch[0])
                         
-                    if sn_attn_out[1] != sn_attn_latch[1]:
-                        sn_attn_latch[1] = sn_attn_out[1]              
-                        output_sn_volume(1, sn_attn_latch[1])
+                        if sn_attn_out[1] != sn_attn_latch[1]:
+                            sn_attn_latch[1] = sn_attn_out[1]              
+                            output_sn_volume(1, sn_attn_latch[1])
 
-                    if sn_attn_out[2] != sn_attn_latch[2]:
-                        sn_attn_latch[2] = sn_attn_out[2]              
-                        output_sn_volume(2, sn_attn_latch[2])
+                        if sn_attn_out[2] != sn_attn_latch[2]:
+                            sn_attn_latch[2] = sn_attn_out[2]              
+                            output_sn_volume(2, sn_attn_latch[2])
 
-                    if sn_attn_out[3] != sn_attn_latch[3]:
-                        sn_attn_latch[3] = sn_attn_out[3]              
-                        output_sn_volume(3, sn_attn_latch[3])
+                        if sn_attn_out[3] != sn_attn_latch[3]:
+                            sn_attn_latch[3] = sn_attn_out[3]              
+                            output_sn_volume(3, sn_attn_latch[3])
 
                 else:                
                     # otherwise output ALL register writes
@@ -2244,38 +2285,55 @@ class YmReader(object):
 
                     if (ENABLE_ENVELOPES):
                         # update the envelope cpu emulation
-                        self.__ymenv.tick( self.__header['chip_clock'] / (50*sample_rate) )
+                        ymenv.tick( env_tick_clocks )
                     if sample_interval == 882:
-                        vgm_stream.extend( struct.pack('B', 0x63) ) 
+                        vgm_stream.append( 0x63 )
                     else:
-                        vgm_stream.extend( struct.pack('B', 0x61) ) 
-                        vgm_stream.extend( struct.pack('B', sample_interval % 256) ) 
-                        vgm_stream.extend( struct.pack('B', sample_interval / 256) )                         
+                        vgm_stream.extend( bytearray((0x61, sample_interval % 256, sample_interval // 256)) )
 
                 else:
                     if False and ENABLE_ENVELOPES:
 
                         for n in range(882):
                             # update the envelope cpu emulation
-                            self.__ymenv.tick( self.__header['chip_clock'] / 44100 )
-                            vgm_stream.extend( struct.pack('B', 0x61) ) 
-                            vgm_stream.extend( struct.pack('B', 0x01) ) 
-                            vgm_stream.extend( struct.pack('B', 0x00) ) 
+                            ymenv.tick( self.__header['chip_clock'] / 44100 )
+                            vgm_stream.extend( bytearray((0x61, 0x01, 0x00)) )
                     else:
                         if (ENABLE_ENVELOPES):
                             # update the envelope cpu emulation
-                            self.__ymenv.tick( self.__header['chip_clock'] / 50 )
-                        vgm_stream.extend( struct.pack('B', 0x63) ) # WAIT50, or 882 samples (44100/50), short for 0x61 0x72 0x03
+                            ymenv.tick( self.__header['chip_clock'] / 50 )
+                        vgm_stream.append( 0x63 ) # WAIT50, or 882 samples (44100/50), short for 0x61 0x72 0x03
 
         #--------------------------------------------
         # Information
         #--------------------------------------------
+        ym_tone_a_max = max(ym_tone_a_column + [0])
+        ym_tone_b_max = max(ym_tone_b_column + [0])
+        ym_tone_c_max = max(ym_tone_c_column + [0])
+
+        ym_tone_a_min = min(ym_tone_a_column + [65536])
+        ym_tone_b_min = min(ym_tone_b_column + [65536])
+        ym_tone_c_min = min(ym_tone_c_column + [65536])
+
+        ym_noise_used = [ n for n in range(32) if ym_noise_hist[n] ]
+        ym_noise_min = min(ym_noise_used + [63356])
+        ym_noise_max = max(ym_noise_used + [0])
+
+        ym_dd_freq_min = min(list(ym_dd_freqs) + [65536])
+        ym_dd_freq_max = max(list(ym_dd_freqs) + [0])
+
+        # range of envelope frequencies, from each distinct envelope period used (a period of 0 means no envelope, so 0Hz)
+        ym_env_periods = set( [ lo + hi*256 for lo, hi in zip(ym_registers[11], ym_registers[12]) ] )
+        ym_env_freqs = [ (env_clock / p if p else 0) for p in ym_env_periods ]
+        ym_env_freq_min = min(ym_env_freqs + [65536])
+        ym_env_freq_max = max(ym_env_freqs + [0])
+
         print("")
         print("Info:")
         print("         Num Frames - " + str(self.__header['nb_frames']))
-        print(" Channel A Hz range - " + str( get_ym_frequency(ym_tone_a_max) ) + "Hz to " + str( get_ym_frequency(ym_tone_a_min) ) + "Hz")
-        print(" Channel B Hz range - " + str( get_ym_frequency(ym_tone_b_max) ) + "Hz to " + str( get_ym_frequency(ym_tone_b_min) ) + "Hz")
-        print(" Channel C Hz range - " + str( get_ym_frequency(ym_tone_c_max) ) + "Hz to " + str( get_ym_frequency(ym_tone_c_min) ) + "Hz")
+        print(" Channel A Hz range - " + str( get_ym_frequency(ym_tone_a_max, clock) ) + "Hz to " + str( get_ym_frequency(ym_tone_a_min, clock) ) + "Hz")
+        print(" Channel B Hz range - " + str( get_ym_frequency(ym_tone_b_max, clock) ) + "Hz to " + str( get_ym_frequency(ym_tone_b_min, clock) ) + "Hz")
+        print(" Channel C Hz range - " + str( get_ym_frequency(ym_tone_c_max, clock) ) + "Hz to " + str( get_ym_frequency(ym_tone_c_min, clock) ) + "Hz")
         print("      Num Digidrums - " + str(self.__header['nb_digidrums']))
         print("  Digidrum Hz range - " + str( ym_dd_freq_min ) + "Hz to " + str( ym_dd_freq_max ) + "Hz")
         print("   Enveloped Frames - " + str( ym_env_count ) + " (" + str( ym_env_count*100.0/self.__header['nb_frames'] ) + "%)")
@@ -2291,11 +2349,10 @@ class YmReader(object):
         # Output the VGM
         #--------------------------------------------
 
-        vgm_stream.extend( struct.pack('B', 0x66) ) # VGM END command
+        vgm_stream.append( 0x66 ) # VGM END command
         vgm_stream_length = len(vgm_stream)		
 
         # build the GD3 data block
-        gd3_data = bytearray()
         gd3_stream = bytearray()	
         gd3_stream_length = 0
         
@@ -2305,86 +2362,82 @@ class YmReader(object):
         VGM_FREQUENCY = 44100
         if not STRIP_GD3: # disable for no GD3 tag
             # note that GD3 requires two-byte characters
-            # title
-            gd3_data.extend( self.__header['song_name'].encode("utf_16le") + b'\x00' + b'\x00') #title_eng' + b'\x00\x00') # title_eng
-            gd3_data.extend( b'\x00\x00') # title_jap
-            # game
-            gd3_data.extend( self.__filename.encode("utf_16le") + b'\x00\x00') # game_eng
-            gd3_data.extend( b'\x00\x00') # game_jap
-            # console
-            gd3_data.extend( 'YM2149F'.encode("utf_16le") + b'\x00\x00') # console_eng
-            gd3_data.extend( b'\x00\x00') # console_jap
-            # author
-            gd3_data.extend( self.__header['author_name'].encode("utf_16le") + b'\x00\x00') # artist_eng
-            gd3_data.extend( b'\x00\x00') # artist_jap
-            # date
-            gd3_data.extend( b'\x00\x00') # date
-            # vgm creator
-            gd3_data.extend( 'github.com/simondotm/ym2149f'.encode("utf_16le") + b'\x00\x00')# vgm_creator
-            # notes
-            gd3_data.extend( self.__header['song_comment'].encode("utf_16le") + b'\x00\x00') # notes
-            
-            gd3_stream.extend(b'Gd3 ')
-            gd3_stream.extend(struct.pack('I', 0x100))				# GD3 version
-            gd3_stream.extend(struct.pack('I', len(gd3_data)))		# GD3 length		
-            gd3_stream.extend(gd3_data)		
+            # each field is a zero terminated UTF-16LE string, so encode them all and join them in one pass
+            gd3_fields = [
+                self.__header['song_name'],     # title_eng
+                '',                             # title_jap
+                self.__filename,                # game_eng
+                '',                             # game_jap
+                'YM2149F',                      # console_eng
+                '',                             # console_jap
+                self.__header['author_name'],   # artist_eng
+                '',                             # artist_jap
+                '',                             # date
+                'github.com/simondotm/ym2149f',  # vgm_creator
+                self.__header['song_comment'],  # notes
+            ]
+            gd3_data = b'\x00\x00'.join( [ field.encode("utf_16le") for field in gd3_fields ] ) + b'\x00\x00'
+
+            # GD3 magic, version and data length, followed by the data
+            gd3_stream = GD3_HEADER.pack(b'Gd3 ', 0x100, len(gd3_data)) + gd3_data
             
             gd3_offset = (64-20) + vgm_stream_length
             gd3_stream_length = len(gd3_stream)
         else:
             print("   VGM Processing : GD3 tag was stripped")
         
-        # build the full VGM output stream		
-        vgm_data = bytearray()
-        vgm_data.extend(b'Vgm ')    # VGM Magic number
-        vgm_data.extend(struct.pack('I', 64 + vgm_stream_length + gd3_stream_length - 4))				# EoF offset
-        vgm_data.extend(struct.pack('I', 0x00000151))		# Version
-        vgm_data.extend(struct.pack('I', vgm_clock)) #self.metadata['sn76489_clock']))
-        vgm_data.extend(struct.pack('I', 0))#self.metadata['ym2413_clock']))
-        vgm_data.extend(struct.pack('I', gd3_offset))				# GD3 offset
-        vgm_data.extend(struct.pack('I', int(cnt*VGM_FREQUENCY/50))) #self.metadata['total_samples']))				# total samples
-        vgm_data.extend(struct.pack('I', 0)) #self.metadata['loop_offset']))				# loop offset
-        vgm_data.extend(struct.pack('I', 0)) #self.metadata['loop_samples']))				# loop # samples
-        vgm_data.extend(struct.pack('I', 50))#self.metadata['rate']))				# rate
-        vgm_data.extend(struct.pack('H', 0x0003))	# 0x0003 for BBC configuration of SN76489 self.metadata['sn76489_feedback']))				# sn fb
-        vgm_data.extend(struct.pack('B', LFSR_BIT)) #self.metadata['sn76489_shift_register_width']))				# SNW	
-        vgm_data.extend(struct.pack('B', 0))				# SN Flags			
-        vgm_data.extend(struct.pack('I', 0))#self.metadata['ym2612_clock']))		
-        vgm_data.extend(struct.pack('I', 0))#self.metadata['ym2151_clock']))	
-        vgm_data.extend(struct.pack('I', 12))				# VGM data offset
-        vgm_data.extend(struct.pack('I', 0))				# SEGA PCM clock	
-        vgm_data.extend(struct.pack('I', 0))				# SPCM interface	
-
-        # attach the vgm data
-        vgm_data.extend(vgm_stream)
+        # build the VGM header
+        # the fixed 64 byte header is packed in one go into a preallocated buffer
+        vgm_data = bytearray(VGM_HEADER.size)
+        VGM_HEADER.pack_into(vgm_data, 0,
+            b'Vgm ',                                                # VGM Magic number
+            64 + vgm_stream_length + gd3_stream_length - 4,        # EoF offset
+            0x00000151,                                             # Version
+            vgm_clock,                                              # SN76489 clock
+            0,                                                      # YM2413 clock
+            gd3_offset,                                             # GD3 offset
+            int(cnt*VGM_FREQUENCY/50),                              # total samples
+            0,                                                      # loop offset
+            0,                                                      # loop # samples
+            50,                                                     # rate
+            0x0003,                                                 # sn fb, 0x0003 for BBC configuration of SN76489
+            LFSR_BIT,                                               # SNW
+            0,                                                      # SN Flags
+            0,                                                      # YM2612 clock
+            0,                                                      # YM2151 clock
+            12,                                                     # VGM data offset
+            0,                                                      # SEGA PCM clock
+            0)                                                      # SPCM interface
 
-        # attach the vgm gd3 tag if required
-        if STRIP_GD3 == False:
-            vgm_data.extend(gd3_stream)
-        
         # write to output file
+        # the header, vgm data and gd3 tag are written out in turn, rather than
+        # first being copied into one combined buffer
         vgm_file = open(vgm_filename, 'wb')
         vgm_file.write(vgm_data)
+        vgm_file.write(vgm_stream)
+
+        # attach the vgm gd3 tag if required
+        if STRIP_GD3 == False:
+            vgm_file.write(gd3_stream)
         vgm_file.close()
-        
-        print("   VGM Processing : Written " + str(int(len(vgm_data))) + " bytes, GD3 tag used " + str(gd3_stream_length) + " bytes")
+
+        vgm_file_length = len(vgm_data) + vgm_stream_length + gd3_stream_length
+        print("   VGM Processing : Written " + str(vgm_file_length) + " bytes, GD3 tag used " + str(gd3_stream_length) + " bytes")
 
         if ENABLE_BIN:
             # write an example SN data BIN format output file
             frame_size = 11 #16
-            frame_total = len(raw_stream) / frame_size
+            frame_total = len(raw_stream) // frame_size
             fh = open(  vgm_filename.rsplit( ".", 1 )[ 0 ] +".bin", 'wb')
     #        fh.write(raw_stream)
 
             frame_count = frame_total #16 # frame_total #33 # number of frames to package at a time
-            #offs = 0
-            for c in range(frame_total / frame_count):
+            block_size = frame_count * frame_size
+            for c in range(frame_total // frame_count):
+                block = raw_stream[c*block_size:(c+1)*block_size]
+                # each register is frame_size bytes apart within a block, so a strided slice deinterleaves it in one go
                 for r in range(frame_size):
-                    rdata = bytearray()
-                    for n in range(frame_count):
-                        rdata.append(raw_stream[c*frame_count*frame_size + n*frame_size + r])
-                    #offs += frame_size
-                    fh.write(rdata)
+                    fh.write(block[r::frame_size])
     
             fh.close()
 
@@ -2406,32 +2459,30 @@ class YmReader(object):
             packet_count = self.__header['nb_frames']
             # emit the play rate & packet count          
             print("play rate is " + str(play_rate))
-            header_block.append(struct.pack('B', play_rate & 0xff))
-            header_block.append(struct.pack('B', packet_count & 0xff))		
-            header_block.append(struct.pack('B', (packet_count >> 8) & 0xff))	
+            header_block.extend( bytearray((play_rate & 0xff, packet_count & 0xff, (packet_count >> 8) & 0xff)) )
 
             print("    Num packets " + str(packet_count))
             duration = packet_count / play_rate
             duration_mm = int(duration / 60.0)
             duration_ss = int(duration % 60.0)
             print("    Song duration " + str(duration) + " seconds, " + str(duration_mm) + "m" + str(duration_ss) + "s")
-            header_block.append(struct.pack('B', duration_mm))	# minutes		
-            header_block.append(struct.pack('B', duration_ss))	# seconds
+            header_block.append(duration_mm)	# minutes		
+            header_block.append(duration_ss)	# seconds
 
             # output the final byte stream
             output_block = bytearray()	
 
             # send header
-            output_block.append(struct.pack('B', len(header_block)))
+            output_block.append(len(header_block))
             output_block.extend(header_block)
 
             # send title
-            title = self.__header['song_name']
+            title = self.__header['song_name'].encode("utf-8")
             if len(title) > 254:
                 title = title[:254]
-            output_block.append(struct.pack('B', len(title) + 1))	# title string length
+            output_block.append(len(title) + 1)	# title string length
             output_block.extend(title)
-            output_block.append(struct.pack('B', 0))				# zero terminator
+            output_block.append(0)				# zero terminator
 
             # send author
             author = self.__header['author_name']
@@ -2440,23 +2491,28 @@ class YmReader(object):
             if len(author) == 0:
                 author = basename(vgm_filename)
 
+            author = author.encode("utf-8")
             if len(author) > 254:
                 author = author[:254]
-            output_block.append(struct.pack('B', len(author) + 1))	# author string length
+            output_block.append(len(author) + 1)	# author string length
             output_block.extend(author)
-            output_block.append(struct.pack('B', 0))				# zero terminator
+            output_block.append(0)				# zero terminator
 
             # now send the raw data
             print(packet_count)
-            print(len(raw_stream)/11)
-
-            for c in range(packet_count):
-                # SN data first
-                for r in range(11):
-                    output_block.append(raw_stream[c*11 + r])
-                # YM data next
-                for r in range(14):
-                    output_block.append(regs[r][c])
+            print(len(raw_stream)//11)
+
+            # each packet is the 11 SN bytes followed by the 14 YM register bytes for a frame
+            # the packets are preallocated, then each register is interleaved into place with a strided slice
+            packet_size = 11 + 14
+            packet_data = bytearray(packet_count * packet_size)
+            # SN data first
+            for r in range(11):
+                packet_data[r::packet_size] = raw_stream[r::11][:packet_count]
+            # YM data next
+            for r in range(14):
+                packet_data[11+r::packet_size] = ym_registers[r]
+            output_block.extend(packet_data)
     
             fh = open( vgm_filename.rsplit( ".", 1 )[ 0 ] + ".bin", 'wb')
             fh.write(output_block)
@@ -2620,21 +2676,28 @@ if __name__ == '__main__':
     if False:
         with open(sys.argv[1], 'w') as fd:
             time.sleep(2) # Wait for Arduino reset
-            frame_t = time.time()
+            # perf_counter is monotonic and high resolution, but needs Python 3.3+
+            timer = getattr(time, 'perf_counter', time.time)
+            frame_period = 1. / header['frames_rate']
+            # frames are scheduled against absolute deadlines, so time spent in code and sleep overshoot don't accumulate as drift
+            frame_deadline = timer()
             for i in range(header['nb_frames']):
-                # Substract time spent in code
-                time.sleep(1./header['frames_rate'] - (time.time() - frame_t))
-                frame_t = time.time()
+                frame_deadline += frame_period
+                slack = frame_deadline - timer()
+                if slack > 0:
+                    time.sleep(slack)
                 fd.write(data[i])
                 fd.flush()
                 i+= 1
 
                 # Additionnal processing
-                cur_min, cur_sec = to_minsec(i, header['frames_rate'])
-                sys.stdout.write(
-                    "\x1b[2K\rPlaying {0:02}:{1:02} / {2:02}:{3:02}".format(
-                    cur_min, cur_sec, song_min, song_sec))
-                sys.stdout.flush()
+                # the play time only shows seconds, so update it once a second rather than every frame
+                if i % header['frames_rate'] == 0:
+                    cur_min, cur_sec = to_minsec(i, header['frames_rate'])
+                    sys.stdout.write(
+                        "\x1b[2K\rPlaying {0:02}:{1:02} / {2:02}:{3:02}".format(
+                        cur_min, cur_sec, song_min, song_sec))
+                    sys.stdout.flush()
 
             # Clear YM2149 registers
             fd.write('\x00'*16)
@@ -29,7 +29,6 @@ import itertools
 import struct
 import sys
 import time
-import binascii
 import math
 import os
 
@@ -52,22 +51,35 @@ ENABLE_VERBOSE = False
 # R12 = Envelope Freq HI   (8 bits)
 # R13 = Envelope Shape     (CONT|ATT|ALT|HOLD)
 
+# YM5/YM6 file header, following the 4 byte format identifier (big endian)
+YM_HEADER = struct.Struct('> 8s I I H I H I H')
+# size of each digidrum sample that follows the YM header (big endian)
+YM_SAMPLE_SIZE = struct.Struct('>I')
+
 class YmReader(object):
 
 
     def __init__(self, fd):
 
-        print "Parsing YM file..."
+        print("Parsing YM file...")
 
-        self.__fd = fd
+        # read the whole file in one go, and parse it from memory
         self.__filename = fd.name
         self.__filesize = os.path.getsize(fd.name) 
+        self.__raw = bytearray( fd.read() )
+        self.__offset = 0
         self.__parse_header()
         self.__data = []
         if not self.__data:
             self.__read_data()
             self.__check_eof()        
 
+    # return the next size bytes of the file, and move past them
+    def __read(self, size):
+        data = self.__raw[self.__offset:self.__offset+size]
+        self.__offset += size
+        return data
+
     def __parse_extra_infos(self):
         if self.__header['id'] == 'YM2!' or self.__header['id'] == 'YM3!' or  self.__header['id'] == 'YM3b':
             self.__header['song_name'] = self.__filename
@@ -76,9 +88,17 @@ class YmReader(object):
         else:
             # YM6!
             # Thanks http://stackoverflow.com/questions/32774910/clean-way-to-read-a-null-terminated-c-style-string-from-a-file
-            toeof = iter(functools.partial(self.__fd.read, 1), '')
+            # read a null terminated string
             def readcstr():
-                return ''.join(itertools.takewhile('\0'.__ne__, toeof))
+                end = self.__raw.find(b'\x00', self.__offset)
+                if end < 0:
+                    end = len(self.__raw)
+                chars = self.__raw[self.__offset:end]
+                self.__offset = end + 1
+                # Atari strings are not necessarily UTF-8, so map the bytes 1:1 (Python 2 keeps the raw str)
+                if str is bytes:
+                    return chars
+                return chars.decode("latin-1")
             self.__header['song_name'] = readcstr()
             self.__header['author_name'] = readcstr()
             self.__header['song_comment'] = readcstr()
@@ -89,17 +109,17 @@ class YmReader(object):
         # ftp://ftp.modland.com/pub/documents/format_documentation/Atari%20ST%20Sound%20Chip%20Emulator%20YM1-6%20(.ay,%20.ym).txt
 
         # Parse the YM file format identifier first
-        ym_format = self.__fd.read(4)
-        print "YM Format: " + ym_format
+        ym_format = self.__read(4).decode("utf-8")
+        print("YM Format: " + ym_format)
 
         # we support YM2, YM3, YM5 and YM6
         
         d = {}
         if ym_format == 'YM2!' or ym_format == 'YM3!' or ym_format == 'YM3b':
-            print "Version 2"
+            print("Version 2")
             d['id'] = ym_format
             d['check_string'] = 'LeOnArD!'
-            d['nb_frames'] = (self.__filesize-4)/14
+            d['nb_frames'] = int( (self.__filesize-4)/14 )
             d['song_attributes'] = 1 # interleaved
             d['nb_digidrums'] = 0
             d['chip_clock'] = 2000000
@@ -110,8 +130,6 @@ class YmReader(object):
         else:
             if ym_format == 'YM6!' or ym_format == 'YM5!':
                 # Then parse the rest based on version
-                ym_header = '> 8s I I H I H I H'
-                s = self.__fd.read(struct.calcsize(ym_header))
                 (d['check_string'],
                 d['nb_frames'],
                 d['song_attributes'],
@@ -120,7 +138,8 @@ class YmReader(object):
                 d['frames_rate'],
                 d['loop_frame'],
                 d['extra_data'],
-                ) = struct.unpack(ym_header, s)
+                ) = YM_HEADER.unpack_from(self.__raw, self.__offset)
+                self.__offset += YM_HEADER.size
 
                 d['id'] = ym_format
                 d['nb_registers'] = 16
@@ -141,38 +160,39 @@ class YmReader(object):
         self.__header = d
 
         if d['interleaved']:
-            print "YM File is Interleaved format"
+            print("YM File is Interleaved format")
 
 
         # read any DD samples
         num_dd = self.__header['nb_digidrums']
         if num_dd != 0:
 
-            print "Music contains " + str(num_dd) + " digi drum samples"
+            print("Music contains " + str(num_dd) + " digi drum samples")
 
             # info
             if d['dd_stformat']:
-                print " Samples are 4-bit ST format" # TODO: what does this mean?!
+                print(" Samples are 4-bit ST format") # TODO: what does this mean?!
             else:
-                print " Samples are UNKNOWN FORMAT" # TODO:so what format is it exactly?! 
+                print(" Samples are UNKNOWN FORMAT") # TODO:so what format is it exactly?!
 
             if d['dd_signed']:
-                print " Samples are SIGNED"
+                print(" Samples are SIGNED")
             else:
-                print " Samples are UNSIGNED"
+                print(" Samples are UNSIGNED")
 
 
-            for i in xrange(num_dd):
+            for i in range(num_dd):
                 # skip over the digidrums sample file data section for now
                 #print self.__fd.tell()
-                sample_size = struct.unpack('>I', self.__fd.read(4))[0]   # get sample size
+                sample_size = YM_SAMPLE_SIZE.unpack_from(self.__raw, self.__offset)[0]   # get sample size
+                self.__offset += YM_SAMPLE_SIZE.size
 
-                print "Found DigiDrums sample " + str(i) + ", " + str(sample_size) + " bytes, loading data..."
+                print("Found DigiDrums sample " + str(i) + ", " + str(sample_size) + " bytes, loading data...")
 
                 #print sample_size
                 #print self.__fd.tell()
                 #print "sample " + str(i) + " size="+str(sample_size)
-                self.__fd.seek(sample_size, 1)      # skip the sample data (for now)
+                self.__offset += sample_size      # skip the sample data (for now)
                 #print self.__fd.tell()            
 
 
@@ -193,18 +213,19 @@ class YmReader(object):
 
         cnt  = self.__header['nb_frames']
 
+        # store each register stream as a bytearray, so indexing it returns the register value as an int
         regs = []
-        for i in xrange( self.__header['nb_registers']):
-            regs.append(self.__fd.read(cnt))            
+        for i in range( self.__header['nb_registers']):
+            regs.append(self.__read(cnt))            
 
         # support output of just the intro (for tunes with looping sections)       
         loop_frame = self.__header['loop_frame']
 
 
         if ENABLE_DEBUG:
-            print " Loaded " + str(len(regs)) + " register data chunks"
-            for r in xrange( self.__header['nb_registers']):
-                print " Register " + str(r) + " entries = " + str(len(regs[r]))
+            print(" Loaded " + str(len(regs)) + " register data chunks")
+            for r in range( self.__header['nb_registers']):
+                print(" Register " + str(r) + " entries = " + str(len(regs[r])))
 
         self.__data = regs
 
@@ -219,15 +240,15 @@ class YmReader(object):
         #print "file offset=" + str(self.__fd.tell())  
 
     def __check_eof(self):
-        if self.__fd.read(4) != 'End!':
-            print '*Warning* End! marker not found after frames'
+        if self.__read(4) != b'End!':
+            print('*Warning* End! marker not found after frames')
 
 
     def dump_header(self):
         for k in ('id','check_string', 'nb_frames', 'nb_registers', 'song_attributes',
                   'nb_digidrums', 'chip_clock', 'frames_rate', 'loop_frame',
                   'extra_data', 'song_name', 'author_name', 'song_comment'):
-            print "{}: {}".format(k, self.__header[k])
+            print("{}: {}".format(k, self.__header[k]))
 
     def get_header(self):
         return self.__header
@@ -238,11 +259,10 @@ class YmReader(object):
     def write_raw(self, filename):
         regs = self.__data
         cnt  = self.__header['nb_frames']
-        raw_data = bytearray()
-
-        for n in xrange(cnt):
-            for r in xrange(14):
-                raw_data.append( regs[r][n] )
+        # interleave the 14 register streams into frames, each register is placed with a single strided slice
+        raw_data = bytearray(cnt * 14)
+        for r in range(14):
+            raw_data[r::14] = regs[r][0:cnt]
 
         # write to output file
         raw_file = open(filename, 'wb')
@@ -281,7 +301,7 @@ if __name__ == '__main__':
     dst = args.output
     if dst == None:
         dst = os.path.splitext(src)[0] + ".ymr"
-    print "output file=" + dst
+    print("output file=" + dst)
 
 
     # check for missing files
@@ -297,8 +317,8 @@ if __name__ == '__main__':
         header = ym.get_header()
         data = ym.get_data()
 
-        print "Loaded YM File."
-        print "Output file: '" + dst + "'"
+        print("Loaded YM File.")
+        print("Output file: '" + dst + "'")
         ym.write_raw( dst )
 
 